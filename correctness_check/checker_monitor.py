@@ -0,0 +1,171 @@
+import os
+import subprocess
+import time
+from pathlib import Path
+
+from proc_usage import process_tree, sum_usage
+
+# the online checker log and the result logs (failed.log) in its output folder
+CHECKER_OUTPUT_PATTERNS = [
+    "traincheck_onlinechecker_*.log",
+    "*/*.log",
+]
+
+
+def list_trace_files(trace_folder: Path) -> list[Path]:
+    """Trace files the online checker picks up from a folder (same rule as traincheck)."""
+    trace_folder = Path(trace_folder)
+    return sorted(
+        p.resolve()
+        for p in trace_folder.iterdir()
+        if p.name.startswith("trace_") or p.name.startswith("proxy_log.json")
+    )
+
+
+def read_file_offsets(pid: int) -> dict[Path, int] | None:
+    """Map every regular file opened by `pid` (and its children) to its read offset.
+
+    Returns None when /proc is not available, so callers can fall back to
+    output-based heuristics only.
+    """
+    if not Path(f"/proc/{pid}").exists():
+        return None
+    offsets: dict[Path, int] = {}
+    for p in process_tree(pid):
+        try:
+            fds = os.listdir(f"/proc/{p}/fd")
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(f"/proc/{p}/fd/{fd}")
+                with open(f"/proc/{p}/fdinfo/{fd}") as f:
+                    pos = int(f.readline().split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            if target.startswith("/"):
+                path = Path(target)
+                offsets[path] = max(pos, offsets.get(path, 0))
+    return offsets
+
+
+def read_cpu_seconds(pid: int) -> float | None:
+    usage = sum_usage(process_tree(pid), io=False)
+    return None if usage is None else usage.cpu_seconds
+
+
+def traces_opened(pid: int, trace_files: list[Path]) -> bool | None:
+    offsets = read_file_offsets(pid)
+    if offsets is None:
+        return None
+    return all(trace in offsets for trace in trace_files)
+
+
+def traces_consumed(pid: int, trace_files: list[Path]) -> bool | None:
+    """Whether the checker has read every trace file up to its current end."""
+    offsets = read_file_offsets(pid)
+    if offsets is None:
+        return None
+    for trace in trace_files:
+        if trace not in offsets:
+            return False
+        if offsets[trace] < trace.stat().st_size:
+            return False
+    return True
+
+
+def _snapshot_outputs(output_dir: Path) -> dict[Path, tuple[int, int]]:
+    output_dir = Path(output_dir)
+    snapshot = {}
+    logs = [
+        log for pattern in CHECKER_OUTPUT_PATTERNS for log in output_dir.glob(pattern)
+    ]
+    for log in logs:
+        try:
+            stat = log.stat()
+        except OSError:
+            continue
+        snapshot[log] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def wait_until_opened(
+    process: subprocess.Popen,
+    trace_files: list[Path],
+    timeout: float,
+    poll_interval: float = 0.1,
+) -> bool:
+    """Block until the checker has opened all trace files, or `timeout` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        opened = traces_opened(process.pid, trace_files)
+        if opened is None:
+            # no /proc, fall back to waiting out the timeout
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            return False
+        if opened:
+            return True
+        time.sleep(poll_interval)
+    return False
+
+
+def wait_until_idle(
+    process: subprocess.Popen,
+    trace_files: list[Path],
+    output_dir: Path,
+    timeout: float,
+    settle: float = 2.0,
+    poll_interval: float = 0.25,
+    idle_cpu_ratio: float = 0.05,
+) -> bool:
+    """Block until the online checker has caught up with the traces and gone quiet.
+
+    The checker is considered done when all trace files are read to their end,
+    none of its log outputs changed for `settle` seconds and it used less than
+    `idle_cpu_ratio` of a core over that window. `timeout` is only an upper
+    bound; returns False when it is hit.
+    """
+    deadline = time.monotonic() + timeout
+
+    last_snapshot = _snapshot_outputs(output_dir)
+    last_cpu = read_cpu_seconds(process.pid)
+    stable_since = time.monotonic()
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        if process.poll() is not None:
+            return True
+
+        now = time.monotonic()
+        snapshot = _snapshot_outputs(output_dir)
+        consumed = traces_consumed(process.pid, trace_files)
+        if snapshot != last_snapshot or consumed is False:
+            last_snapshot = snapshot
+            last_cpu = read_cpu_seconds(process.pid)
+            stable_since = now
+            continue
+
+        if now - stable_since < settle:
+            continue
+
+        cpu = read_cpu_seconds(process.pid)
+        if cpu is not None and last_cpu is not None:
+            busy = (cpu - last_cpu) / (now - stable_since)
+            if busy > idle_cpu_ratio:
+                last_cpu = cpu
+                stable_since = now
+                continue
+        return True
+    return False
+
+
+def stop_checker(process: subprocess.Popen, timeout: float = 5) -> None:
+    """Send SIGTERM so the checker writes its summary lines, then wait for it to exit."""
+    try:
+        process.terminate()
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"Force killing unresponsive checker process {process.pid}")
+        process.kill()
+        process.wait()
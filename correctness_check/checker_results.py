@@ -0,0 +1,189 @@
+import os
+import tempfile
+from collections import Counter
+from typing import Iterator
+
+from invariant_json import (
+    DIGEST_SIZE,
+    READ_CHUNK_SIZE,
+    digest,
+    invariant_fingerprint,
+    iter_json_objects,
+)
+
+from traincheck.invariant.base_cls import Invariant
+from traincheck.trace import MDNONEJSONDecoder
+
+
+def read_inv_file(file_path, chunk_size=READ_CHUNK_SIZE) -> Iterator[Invariant]:
+    """Yield the invariants stored in an invariants.json or checker result file.
+
+    Checker results wrap each invariant in an "invariant" field while invariant
+    files store it at the top level; both are accepted.
+    """
+    for obj in iter_json_objects(file_path, MDNONEJSONDecoder, chunk_size):
+        yield Invariant.from_dict(obj.get("invariant", obj))
+
+
+# rough cost of one Counter entry keyed by a 16 byte digest
+COUNTER_ENTRY_BYTES = 200
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+N_PARTITIONS = 64
+
+
+def invariant_key(violation: dict) -> bytes:
+    return invariant_fingerprint(violation["invariant"])
+
+
+def trace_location(violation: dict) -> list:
+    """Timestamps of the trace records a violation was reported on."""
+    trace = violation.get("trace") or []
+    return sorted(record["time"] for record in trace if record.get("time") is not None)
+
+
+def violation_key(violation: dict) -> bytes:
+    return invariant_key(violation) + digest(trace_location(violation))
+
+
+def _iter_keys(failed_log):
+    if failed_log is None or not os.path.exists(failed_log):
+        return
+    for violation in iter_json_objects(failed_log):
+        yield invariant_key(violation), violation_key(violation)
+
+
+def _count_in_memory(failed_log, max_entries):
+    counts = Counter()
+    invariants = set()
+    for inv_key, key in _iter_keys(failed_log):
+        counts[key] += 1
+        invariants.add(inv_key)
+        if len(counts) > max_entries:
+            return None, None
+    return counts, invariants
+
+
+def _partition_to_disk(failed_log, tmp_dir, side):
+    """Spread the violation keys of a file over N_PARTITIONS files by digest prefix."""
+    invariants = set()
+    parts = [
+        open(os.path.join(tmp_dir, f"{side}_{i}"), "wb") for i in range(N_PARTITIONS)
+    ]
+    try:
+        for inv_key, key in _iter_keys(failed_log):
+            invariants.add(inv_key)
+            parts[key[-1] % N_PARTITIONS].write(key)
+    finally:
+        for part in parts:
+            part.close()
+    return invariants
+
+
+def _read_partition(path):
+    counts = Counter()
+    key_size = 2 * DIGEST_SIZE
+    with open(path, "rb") as f:
+        while True:
+            key = f.read(key_size)
+            if not key:
+                return counts
+            counts[key] += 1
+
+
+class ViolationDiff:
+    """Multiset difference between two failed.log files, keyed by violation."""
+
+    def __init__(self, max_examples: int = 20):
+        self.max_examples = max_examples
+        self.output_total = 0
+        self.reference_total = 0
+        self.only_in_output = 0
+        self.only_in_reference = 0
+        self.output_invariants: set[bytes] = set()
+        self.reference_invariants: set[bytes] = set()
+        # a few mismatching keys, used to describe the differences
+        self.examples: dict[bytes, str] = {}
+
+    def add(self, output_counts: Counter, reference_counts: Counter):
+        self.output_total += sum(output_counts.values())
+        self.reference_total += sum(reference_counts.values())
+        for side, extra in (
+            ("output", output_counts - reference_counts),
+            ("reference", reference_counts - output_counts),
+        ):
+            n_extra = sum(extra.values())
+            if side == "output":
+                self.only_in_output += n_extra
+            else:
+                self.only_in_reference += n_extra
+            for key in extra:
+                if len(self.examples) >= self.max_examples:
+                    break
+                self.examples[key] = side
+
+    @property
+    def identical(self) -> bool:
+        return self.only_in_output == 0 and self.only_in_reference == 0
+
+    def describe(self, output_log, reference_log) -> str:
+        lines = [
+            f"output: {self.output_total} violations of {len(self.output_invariants)} invariants, "
+            f"reference: {self.reference_total} violations of {len(self.reference_invariants)} invariants",
+            f"{self.only_in_output} violations only in output, "
+            f"{self.only_in_reference} only in reference",
+        ]
+        pending = dict(self.examples)
+        for side, failed_log in (("output", output_log), ("reference", reference_log)):
+            if failed_log is None or not os.path.exists(failed_log):
+                continue
+            for violation in iter_json_objects(failed_log):
+                if not pending:
+                    break
+                key = violation_key(violation)
+                if pending.get(key) != side:
+                    continue
+                del pending[key]
+                invariant = violation["invariant"]
+                lines.append(
+                    f"  only in {side}: {invariant.get('relation')} "
+                    f"{invariant.get('text_description')} at {trace_location(violation)}"
+                )
+        return "\n".join(lines)
+
+
+def diff_violations(
+    output_log, reference_log, memory_budget: int = DEFAULT_MEMORY_BUDGET
+) -> ViolationDiff:
+    """Compare two failed.log files without holding either of them in memory.
+
+    Violations are reduced to fixed-size digests of their invariant and trace
+    location. If the distinct digests do not fit in `memory_budget`, they are
+    partitioned to disk and the partitions are compared one at a time.
+    A missing file counts as no violations.
+    """
+    diff = ViolationDiff()
+    max_entries = max(1, memory_budget // COUNTER_ENTRY_BYTES // 2)
+    output_counts, output_invariants = _count_in_memory(output_log, max_entries)
+    reference_counts, reference_invariants = (None, None)
+    if output_counts is not None:
+        reference_counts, reference_invariants = _count_in_memory(
+            reference_log, max_entries
+        )
+    if output_counts is not None and reference_counts is not None:
+        diff.output_invariants = output_invariants
+        diff.reference_invariants = reference_invariants
+        diff.add(output_counts, reference_counts)
+        return diff
+
+    output_counts = reference_counts = None
+    with tempfile.TemporaryDirectory(prefix="violation_diff_") as tmp_dir:
+        diff.output_invariants = _partition_to_disk(output_log, tmp_dir, "output")
+        diff.reference_invariants = _partition_to_disk(
+            reference_log, tmp_dir, "reference"
+        )
+        for i in range(N_PARTITIONS):
+            diff.add(
+                _read_partition(os.path.join(tmp_dir, f"output_{i}")),
+                _read_partition(os.path.join(tmp_dir, f"reference_{i}")),
+            )
+    return diff
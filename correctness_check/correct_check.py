@@ -1,21 +1,43 @@
+import argparse
 import json
-import re
+import shutil
 import subprocess
 import sys
 import time
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
-from traincheck.invariant.base_cls import Invariant
-from traincheck.trace import MDNONEJSONDecoder
+from checker_monitor import list_trace_files, stop_checker, wait_until_idle
+from checker_results import diff_violations
+from result_cache import cache_lookup, cache_store, case_key, checker_version
+
+SIMULATOR = Path(__file__).resolve().parent / "simulator.py"
+# scripts that drive the checker in any mode, part of the result cache key
+HARNESS_FILES = [
+    SIMULATOR.parent / name
+    for name in [
+        "correct_check.py",
+        "simulator.py",
+        "checker_monitor.py",
+        "invariant_json.py",
+        "proc_usage.py",
+    ]
+]
+SIMULATOR_REPORT = "simulator_report.json"
+# every checker run writes its results to this folder inside the case workdir
+RESULTS_DIR = "checker_results"
+ONLINE_CHECKER_LOG = "traincheck_onlinechecker_*.log"
+
+PASS, FAIL, SKIP = "PASS", "FAIL", "SKIP"
 
 
 def collect_trace_dirs(reference_root: str = "./reference_result") -> list[Path]:
     trace_dirs = []
     simulate_trace_dirs = []
-    for group_dir in Path(reference_root).iterdir():
+    for group_dir in sorted(Path(reference_root).resolve().iterdir()):
         if group_dir.is_dir():
-            for trace_dir in group_dir.iterdir():
+            for trace_dir in sorted(group_dir.iterdir()):
                 if trace_dir.name.endswith("static") and trace_dir.is_dir():
                     trace_dirs.append(trace_dir)
                 if trace_dir.name.endswith("simulated") and trace_dir.is_dir():
@@ -39,7 +61,24 @@ def find_trace_components(trace_dir: Path):
 
     if not trace or not reference_out or not invariant.exists():
         raise FileNotFoundError(f"Incomplete files in {trace_dir}")
-    return trace, reference_out, invariant
+    return trace, reference_failed_log(invariant.parent, reference_out), invariant
+
+
+def reference_failed_log(results_dir: Path, checker_log: Path) -> Path | None:
+    """The failed.log of a reference online run, None if it cannot be trusted.
+
+    The online checker only writes failed.log once something is violated, so
+    a missing one stands for "no violations" only if the reference checker log
+    ends with the summary of a completed run that found none.
+    """
+    failed_log = results_dir / "failed.log"
+    if failed_log.exists():
+        return failed_log
+    with open(checker_log, "r") as f:
+        last_lines = deque(f, maxlen=5)
+    if any("Total 0 violations found" in line for line in last_lines):
+        return failed_log
+    return None
 
 
 def find_trace_components_offline(trace_dir: Path):
@@ -59,106 +98,93 @@ def find_trace_components_offline(trace_dir: Path):
 
     if not trace or not reference_out or not invariant.exists():
         raise FileNotFoundError(f"Incomplete files in {trace_dir}")
-    return trace, reference_out, invariant
+    # the offline checker always writes failed.log, without it the reference is broken
+    return trace, reference_out if reference_out.exists() else None, invariant
+
 
+def find_checker_log(workdir: Path, pattern: str) -> Path:
+    """The checker names its log after the start time; a case workdir holds exactly one."""
+    logs = list(workdir.glob(pattern))
+    if len(logs) != 1:
+        raise FileNotFoundError(
+            f"Expected one checker log matching {pattern} in {workdir}, found {len(logs)}"
+        )
+    return logs[0]
 
-def run_online_checker(trace: Path, invariant: Path) -> Path:
+
+def run_online_checker(
+    trace: Path, invariant: Path, workdir: Path, timeout: float = 20
+) -> tuple[Path, Path]:
+    """Run the online checker with its results in `workdir`.
+
+    Returns the failed.log (absent if nothing was violated) and the checker log.
+    """
+    output_dir = workdir / RESULTS_DIR
     command = ["traincheck-onlinecheck", "-f", str(trace), "-i", str(invariant)]
+    command += ["-o", str(output_dir)]
     process = subprocess.Popen(
-        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
     )
 
-    try:
-        time.sleep(20)
-        process.terminate()
-        process.wait(timeout=5)
-    except subprocess.TimeoutExpired:
-        print(f"Force killing unresponsive process for {trace}")
-        process.kill()
-        process.wait()
-
-    # Find latest log file
-    log_files = sorted(
-        Path(".").glob("*.log"), key=lambda p: p.stat().st_mtime, reverse=True
-    )
-    if not log_files:
-        raise FileNotFoundError("No log output found after checker run.")
-    return log_files[0]
+    # stop as soon as the checker has consumed the trace and gone quiet,
+    # `timeout` is only an upper bound
+    if not wait_until_idle(process, list_trace_files(trace), workdir, timeout):
+        print(f"Checker did not settle within {timeout}s for {trace}")
+    stop_checker(process)
+
+    return output_dir / "failed.log", find_checker_log(workdir, ONLINE_CHECKER_LOG)
 
 
-def run_simulator(trace_dir: Path, invariant: Path) -> Path:
+def run_simulator(trace_dir: Path, invariant: Path, workdir: Path) -> tuple[Path, Path]:
+    output_dir = workdir / RESULTS_DIR
     subprocess.run(
-        ["python3", "simulator.py", "-f", str(trace_dir), "-i", str(invariant)],
+        [
+            "python3",
+            str(SIMULATOR),
+            "-f",
+            str(trace_dir),
+            "-i",
+            str(invariant),
+            "-o",
+            str(output_dir),
+            "--report",
+            SIMULATOR_REPORT,
+        ],
+        cwd=workdir,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
     )
-    log_files = sorted(
-        Path(".").glob("*.log"), key=lambda p: p.stat().st_mtime, reverse=True
-    )
-    if not log_files:
-        raise FileNotFoundError("No log output found after checker run.")
-    return log_files[0]
+    return output_dir / "failed.log", find_checker_log(workdir, ONLINE_CHECKER_LOG)
 
 
-def run_offline_checker(trace: Path, invariant: Path) -> Path:
+def run_offline_checker(trace: Path, invariant: Path, workdir: Path) -> Path:
+    output_dir = workdir / RESULTS_DIR
     command = ["traincheck-check", "-f", str(trace), "-i", str(invariant)]
-    process = subprocess.Popen(
-        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    command += ["-o", str(output_dir)]
+    subprocess.run(
+        command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
     )
 
-    process.wait()
-
-    candidates = [p for p in Path(".").glob("traincheck_checker_result*") if p.is_dir()]
-    log_files = max(candidates, key=lambda p: p.stat().st_mtime)
-
-    if not log_files:
-        raise FileNotFoundError("No log output found after checker run.")
-    for item in log_files.iterdir():
-        if item.name.startswith("trace") and item.is_dir():
-            print(item.name)
-            return item / "failed.log"
-
-
-def extract_summary_info(log_path: Path):
-    last_lines = deque(open(log_path), maxlen=3)
-
-    violations_count = None
-    invariants_count = None
-    for line in last_lines:
-        if "violations found" in line:
-            match = re.search(r"Total (\d+) violations found", line)
-            if match:
-                violations_count = int(match.group(1))
-        elif "invariants violated" in line:
-            match = re.search(r"Total (\d+) invariants violated", line)
-            if match:
-                invariants_count = int(match.group(1))
-    return violations_count, invariants_count
+    # the checker writes one result folder per trace folder, named after it
+    failed_log = output_dir / trace.name / "failed.log"
+    if not failed_log.exists():
+        raise FileNotFoundError(f"No checker results found in {output_dir}")
+    return failed_log
 
 
 def compare_logs(output_log: Path, reference_log: Path) -> bool:
-    result = subprocess.run(
-        ["diff", "-w", str(output_log), str(reference_log)], capture_output=True
-    )
-    if result.returncode == 0:
+    diff = diff_violations(output_log, reference_log)
+    if diff.identical:
         return True
 
-    # Soft match check
-    v1, i1 = extract_summary_info(output_log)
-    v2, i2 = extract_summary_info(reference_log)
-
-    print(f"{v1} vs {v2}, {i1} vs {i2}")
-
-    if None in (v1, v2, i1, i2):
-        return False
+    print(diff.describe(output_log, reference_log))
 
-    if i1 != i2:
+    # Soft match check, online checking is timing dependent so the exact set
+    # of reported violations may differ slightly between runs
+    if diff.output_invariants != diff.reference_invariants:
         return False
 
-    if v1 == 0 and v2 == 0:
-        print("soft check pass")
-        return True
-
+    v1, v2 = diff.output_total, diff.reference_total
     diff_ratio = abs(v1 - v2) / max(v1, v2)
     if diff_ratio <= 0.1:
         print("soft check pass")
@@ -168,91 +194,248 @@ def compare_logs(output_log: Path, reference_log: Path) -> bool:
 
 
 def compare_offline_logs(output_log: Path, reference_log: Path) -> bool:
-    failed_invs = read_inv_file(output_log)
-    reference_invs = read_inv_file(reference_log)
-
-    if failed_invs == reference_invs:
+    diff = diff_violations(output_log, reference_log)
+    if diff.identical:
         return True
 
     print(str(output_log), str(reference_log))
+    print(diff.describe(output_log, reference_log))
     return False
 
 
-def read_inv_file(file_path: Path) -> list[Invariant]:
-    with open(file_path, "r") as f:
-        content = f.read()
-        try:
-            all_json_objects = json.loads(
-                "[" + content.strip().replace("}\n{", "},\n{") + "]",
-                cls=MDNONEJSONDecoder,
-            )
-        except json.JSONDecodeError as e:
-            raise ValueError(f"JSON decode failed: {e}") from e
+def get_case_workdir(scratch_root: Path, mode: str, trace_dir: Path) -> Path:
+    return scratch_root / f"{mode}_{trace_dir.parent.name}_{trace_dir.name}"
 
-    invs = []
-    for raw in all_json_objects:
-        if "invariant" not in raw:
-            raise ValueError("Missing 'invariant' field in one object.")
-        inv = Invariant.from_dict(raw["invariant"])
-        invs.append(inv)
-    return invs
 
+def run_checker(mode: str, trace: Path, invariant: Path, workdir: Path):
+    """Run the checker for one case and return (failed.log, checker log)."""
+    if mode == "offline":
+        return run_offline_checker(trace, invariant, workdir), None
+    if mode == "online":
+        return run_online_checker(trace, invariant, workdir)
+    return run_simulator(trace, invariant, workdir)
 
-def main():
-    static_trace_dirs, simulate_trace_dirs = collect_trace_dirs()
-    all_passed = True
 
-    # # online static check
-    for trace_dir in static_trace_dirs:
-        try:
-            trace, ref_log, invariant = find_trace_components(trace_dir)
-            out_log = run_online_checker(trace, invariant)
-            if compare_logs(out_log, ref_log):
-                print(f"Check passed for {trace_dir}")
-            else:
-                print(f"Check failed for {trace_dir}")
-                all_passed = False
-                with open(str(out_log), "r") as f:
-                    print(f.read())
-                sys.exit(1)
-        except Exception as e:
-            print(f"Error processing {trace_dir}: {e}")
-            all_passed = False
-            sys.exit(1)
-
-    # # online simulated check
-    for trace_dir in simulate_trace_dirs:
-        try:
-            trace, ref_log, invariant = find_trace_components(trace_dir)
-            out_log = run_simulator(trace, invariant)
-            if compare_logs(out_log, ref_log):
-                print(f"Check passed for {trace_dir}")
-            else:
-                print(f"Check failed for {trace_dir}")
-                all_passed = False
-                sys.exit(1)
-        except Exception as e:
-            print(f"Error processing {trace_dir}: {e}")
-            all_passed = False
-            sys.exit(1)
+def run_case(
+    mode: str,
+    trace_dir: Path,
+    workdir: Path,
+    cache_root: Path | None = None,
+    only_changed: bool = False,
+) -> tuple[str, str]:
+    """Run a single reference case inside its own scratch directory.
 
+    With a `cache_root`, the checker output of a previous run on identical
+    traces, invariants and traincheck sources is reused instead of running
+    the checker; with `only_changed` such cases are skipped altogether.
+    Returns the case status (PASS, FAIL or SKIP) and a message for the report.
+    """
+    if mode == "offline":
+        trace, ref_log, invariant = find_trace_components_offline(trace_dir)
+    else:
+        trace, ref_log, invariant = find_trace_components(trace_dir)
+    if ref_log is None:
+        return SKIP, f"No usable reference failed.log, skipped {trace_dir}"
+
+    key = out_log = checker_log = None
+    if cache_root is not None:
+        key = case_key(
+            mode,
+            list_trace_files(trace),
+            invariant,
+            checker_version(),
+            HARNESS_FILES,
+        )
+        out_log = cache_lookup(cache_root, key)
+        if out_log is not None and only_changed:
+            return SKIP, f"Unchanged since the last passing run, skipped {trace_dir}"
+
+    cached = out_log is not None
+    if not cached:
+        if workdir.exists():
+            shutil.rmtree(workdir)
+        workdir.mkdir(parents=True)
+        out_log, checker_log = run_checker(mode, trace, invariant, workdir)
+
+    compare = compare_offline_logs if mode == "offline" else compare_logs
+    label = "Offline check" if mode == "offline" else "Check"
+    suffix = " (cached checker output)" if cached else ""
+    if compare(out_log, ref_log):
+        # only passing runs are cached, so a flaky failure is always rerun
+        if key is not None and not cached:
+            meta = {"mode": mode, "trace_dir": str(trace_dir)}
+            cache_store(cache_root, key, out_log, meta)
+        return PASS, f"{label} passed for {trace_dir}{suffix}"
+
+    message = f"{label} failed for {trace_dir}{suffix}"
+    if checker_log is not None and mode == "online":
+        with open(str(checker_log), "r") as f:
+            message += "\n" + f.read()
+    return FAIL, message
+
+
+def collect_cases(reference_root: str) -> list[tuple[str, Path]]:
+    static_trace_dirs, simulate_trace_dirs = collect_trace_dirs(reference_root)
+    cases = []
+    # online static check
+    cases.extend(("online", trace_dir) for trace_dir in static_trace_dirs)
+    # online simulated check
+    cases.extend(("simulated", trace_dir) for trace_dir in simulate_trace_dirs)
     # offline static check
-    for trace_dir in static_trace_dirs:
-        if "modified" in str(trace_dir):
+    cases.extend(
+        ("offline", trace_dir)
+        for trace_dir in static_trace_dirs
+        if "modified" not in str(trace_dir)
+    )
+    return cases
+
+
+def _run_case_safe(
+    mode: str,
+    trace_dir: Path,
+    workdir: Path,
+    cache_root: Path | None,
+    only_changed: bool,
+) -> tuple[str, str, float]:
+    start = time.perf_counter()
+    try:
+        status, message = run_case(mode, trace_dir, workdir, cache_root, only_changed)
+    except Exception as e:
+        status, message = FAIL, f"Error processing {trace_dir}: {e}"
+    return status, message, time.perf_counter() - start
+
+
+def print_latency_reports(cases: list[tuple[str, Path]], scratch_root: Path):
+    """Print the simulator's per-relation detection latency for each simulated trace."""
+    print("=" * 80)
+    print("Detection latency (violating event written -> flagged by the checker)")
+    for mode, trace_dir in cases:
+        if mode != "simulated":
+            continue
+        report_file = get_case_workdir(scratch_root, mode, trace_dir) / SIMULATOR_REPORT
+        print(f"--- {trace_dir.parent.name}/{trace_dir.name}")
+        if not report_file.exists():
+            print("no simulator report")
             continue
-        try:
-            trace, ref_log, invariant = find_trace_components_offline(trace_dir)
-            out_log = run_offline_checker(trace, invariant)
-            if compare_offline_logs(out_log, ref_log):
-                print(f"Offline check passed for {trace_dir}")
-            else:
-                print(f"Offline check failed for {trace_dir}")
-                all_passed = False
-                sys.exit(1)
-        except Exception as e:
-            print(f"Error processing {trace_dir}: {e}")
+        with open(report_file, "r") as f:
+            report = json.load(f)
+        latency = report.get("detection_latency", {})
+        skipped = report.get("detection_latency_skipped", {})
+        n_skipped = sum(skipped.values())
+        if n_skipped:
+            print(
+                f"WARNING: no detection latency for {n_skipped} violations "
+                f"({skipped.get('no_detection_time', 0)} without a detection_time "
+                "from the checker), see the simulator output"
+            )
+        elif not latency:
+            print("no violations detected")
+        for relation, stats in latency.items():
+            print(
+                f"{relation:<40} n={stats['count']:<5} p50={stats['p50_ms']:.1f}ms "
+                f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check traincheck checker outputs against the reference results."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of reference cases to run concurrently, each in its own worker process",
+    )
+    parser.add_argument(
+        "--reference-root",
+        type=str,
+        default="./reference_result",
+        help="Folder containing the reference result groups",
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        type=str,
+        default="./traincheck_scratch",
+        help="Folder under which every case gets its own working directory",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="./result_cache",
+        help="Folder caching the checker output of passing cases by content hash",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always run the checker and do not update the result cache",
+    )
+    parser.add_argument(
+        "--only-changed",
+        action="store_true",
+        help="Only run the cases whose traces, invariants or traincheck sources changed",
+    )
+    parser.add_argument(
+        "--latency",
+        action="store_true",
+        help="Report p50/p95/p99 violation detection latency for the simulated cases",
+    )
+    args = parser.parse_args()
+
+    cases = collect_cases(args.reference_root)
+    scratch_root = Path(args.scratch_dir).resolve()
+    scratch_root.mkdir(parents=True, exist_ok=True)
+    if args.no_cache and args.only_changed:
+        parser.error("--only-changed needs the result cache")
+    cache_root = None if args.no_cache else Path(args.cache_dir).resolve()
+
+    wall_start = time.perf_counter()
+    results: dict[tuple[str, Path], tuple[str, str, float]] = {}
+    if args.jobs <= 1:
+        for mode, trace_dir in cases:
+            workdir = get_case_workdir(scratch_root, mode, trace_dir)
+            results[(mode, trace_dir)] = _run_case_safe(
+                mode, trace_dir, workdir, cache_root, args.only_changed
+            )
+            print(results[(mode, trace_dir)][1])
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = {
+                executor.submit(
+                    _run_case_safe,
+                    mode,
+                    trace_dir,
+                    get_case_workdir(scratch_root, mode, trace_dir),
+                    cache_root,
+                    args.only_changed,
+                ): (mode, trace_dir)
+                for mode, trace_dir in cases
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                print(results[futures[future]][1])
+    wall_time = time.perf_counter() - wall_start
+
+    # report in the same order as the cases were collected
+    print("=" * 80)
+    all_passed = True
+    for mode, trace_dir in cases:
+        status, message, duration = results[(mode, trace_dir)]
+        print(f"[{status}] {mode:<9} {trace_dir} ({duration:.1f}s)")
+        if status == FAIL:
             all_passed = False
-            sys.exit(1)
+            print(message)
+    total_case_time = sum(duration for _, _, duration in results.values())
+    statuses = [status for status, _, _ in results.values()]
+    print(
+        f"{len(cases)} cases, {statuses.count(PASS)} passed, "
+        f"{statuses.count(SKIP)} skipped, "
+        f"wall time {wall_time:.1f}s (sum of case times {total_case_time:.1f}s)"
+    )
+
+    if args.latency:
+        print_latency_reports(cases, scratch_root)
 
     if all_passed:
         print("All checks passed!")
@@ -0,0 +1,106 @@
+"""Streaming and fingerprinting of checker and invariant JSON files.
+
+Plain json and hashlib only, so that it can be used without traincheck.
+false-positive/invariant_json.py links to this file.
+"""
+
+import hashlib
+import json
+
+READ_CHUNK_SIZE = 1 << 20
+
+
+def iter_json_objects(file_path, cls=None, chunk_size=READ_CHUNK_SIZE):
+    """Yield the concatenated JSON objects of a checker output file one at a time.
+
+    Checker results (failed.log and friends) are a sequence of pretty-printed
+    JSON objects separated by arbitrary whitespace. They are decoded
+    incrementally with `raw_decode`, so only the object being parsed and one
+    read chunk are held in memory. An object that does not fit is retried
+    after reading at least as much again as is pending, which keeps the
+    repeated decoding of large objects linear in their size.
+    """
+    decoder = json.JSONDecoder() if cls is None else cls()
+    buffer = ""
+    pos = 0
+    with open(file_path, "r") as f:
+        eof = False
+        while True:
+            # skip the whitespace between objects
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                try:
+                    obj, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # an object ending exactly at the buffer end may be a
+                    # truncated number, read more before trusting it
+                    if end < len(buffer) or eof:
+                        yield obj
+                        pos = end
+                        continue
+            elif eof:
+                return
+
+            chunk = f.read(max(chunk_size, len(buffer) - pos))
+            if not chunk:
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+
+DIGEST_SIZE = 16
+
+
+def dumps(obj) -> str:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def digest(obj) -> bytes:
+    return hashlib.blake2b(dumps(obj).encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def _canonical_clause(clause: dict) -> dict:
+    # the values of a constant clause come from a set
+    if "values" in clause:
+        return {**clause, "values": sorted(clause["values"], key=dumps)}
+    return clause
+
+
+def _canonical_precondition(precondition):
+    """Preconditions of a group form a disjunction and the clauses of each a conjunction, so neither order matters."""
+    if not isinstance(precondition, dict):
+        # "Failed" or missing
+        return precondition
+    groups = {}
+    for group_name, group in precondition.items():
+        preconditions = []
+        for p in group["preconditions"]:
+            clauses = p["clauses"]
+            if isinstance(clauses, list):
+                clauses = sorted(map(_canonical_clause, clauses), key=dumps)
+            preconditions.append({**p, "clauses": clauses})
+        groups[group_name] = {
+            **group,
+            "preconditions": sorted(preconditions, key=dumps),
+        }
+    return groups
+
+
+def invariant_fingerprint(inv_dict: dict) -> bytes:
+    """Canonical digest of an invariant's relation, params and precondition.
+
+    Descriptive fields (text description, example counts) are left out, so
+    the same invariant inferred from different inputs has the same
+    fingerprint. Unlike `Invariant.__eq__`, the precondition is included.
+    """
+    return digest(
+        {
+            "relation": inv_dict["relation"],
+            "params": inv_dict["params"],
+            "precondition": _canonical_precondition(inv_dict.get("precondition")),
+        }
+    )
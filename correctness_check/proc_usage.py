@@ -0,0 +1,99 @@
+"""CPU time, memory and I/O of processes, read from /proc.
+
+Plain Python only. false-positive/proc_usage.py and
+instr-overhead/proc_usage.py link to this file.
+"""
+
+import glob
+import os
+from typing import NamedTuple
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class Usage(NamedTuple):
+    cpu_seconds: float
+    rss_bytes: int
+    read_bytes: int
+    write_bytes: int
+
+
+def read_stat(pid: int) -> list[str]:
+    """Fields of /proc/<pid>/stat after the command name, which may contain
+    spaces. Field N of proc(5) is at index N - 3."""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        return f.read().rsplit(")", 1)[1].split()
+
+
+def process_tree(pid: int) -> list[int]:
+    """`pid` and all of its descendants that are still alive."""
+    pids = [pid]
+    for parent in pids:
+        for children_file in glob.glob(f"/proc/{parent}/task/*/children"):
+            try:
+                with open(children_file, "r") as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+    return pids
+
+
+def process_group(pgid: int) -> list[int]:
+    """Processes of the process group `pgid`, also those whose parent exited."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            # pgrp is field 5
+            if int(read_stat(int(entry))[2]) == pgid:
+                pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            # exited in the meantime
+            continue
+    return pids
+
+
+def read_usage(pid: int, io: bool = True, children: bool = False) -> Usage:
+    """Usage of one process, raises OSError if it is gone.
+
+    With `children` the CPU time of its exited and reaped children is included.
+    """
+    fields = read_stat(pid)
+    # utime and stime are fields 14 and 15, rss field 24 in pages
+    cpu_ticks = int(fields[11]) + int(fields[12])
+    if children:
+        # cutime and cstime are fields 16 and 17
+        cpu_ticks += int(fields[13]) + int(fields[14])
+    cpu_seconds = cpu_ticks / CLOCK_TICKS
+    rss_bytes = int(fields[21]) * PAGE_SIZE
+    read_bytes = write_bytes = 0
+    if io:
+        try:
+            with open(f"/proc/{pid}/io", "r") as f:
+                for line in f:
+                    key, value = line.split(":")
+                    if key == "read_bytes":
+                        read_bytes = int(value)
+                    elif key == "write_bytes":
+                        write_bytes = int(value)
+        except OSError:
+            # /proc/<pid>/io is not readable for processes of other users
+            pass
+    return Usage(cpu_seconds, rss_bytes, read_bytes, write_bytes)
+
+
+def sum_usage(pids: list[int], io: bool = True, children: bool = False) -> Usage | None:
+    """Summed usage of `pids`, processes that exit meanwhile are skipped.
+
+    None if none of them could be read, e.g. without /proc.
+    """
+    total = None
+    for pid in pids:
+        try:
+            usage = read_usage(pid, io, children)
+        except (OSError, IndexError, ValueError):
+            continue
+        total = usage if total is None else Usage(*map(sum, zip(total, usage)))
+    return total
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from importlib import metadata, util
+from pathlib import Path
+
+HASH_CHUNK_SIZE = 1 << 20
+CACHED_FAILED_LOG = "failed.log"
+CACHE_META = "meta.json"
+
+
+def _hash_file(h, path: Path, name: str | None = None):
+    h.update((path.name if name is None else name).encode() + b"\0")
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    h.update(b"\0")
+
+
+def _source_hash(package: str) -> str:
+    """Hash of the files of an installed package, without importing it."""
+    spec = util.find_spec(package)
+    if spec is None or not spec.submodule_search_locations:
+        return "unknown"
+    h = hashlib.blake2b(digest_size=8)
+    for location in spec.submodule_search_locations:
+        root = Path(location)
+        for path in sorted(root.rglob("*")):
+            if "__pycache__" in path.parts or not path.is_file():
+                continue
+            _hash_file(h, path, path.relative_to(root).as_posix())
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def checker_version() -> str:
+    """Version and source hash of the installed traincheck.
+
+    The version of an editable install stays the same while its code
+    changes, so the sources are hashed as well.
+    """
+    try:
+        version = metadata.version("traincheck")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    return f"{version}+{_source_hash('traincheck')}"
+
+
+def case_key(
+    mode: str,
+    trace_files: list[Path],
+    invariant: Path,
+    version: str,
+    extra_files: list[Path] = (),
+) -> str:
+    """Content hash of everything a checker run depends on.
+
+    `extra_files` holds the harness scripts that drive the checker (e.g. the
+    simulator and checker_monitor.py), so editing them invalidates the cached
+    results of every mode.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{mode}\0{version}\0".encode())
+    for trace_file in sorted(trace_files):
+        _hash_file(h, trace_file)
+    _hash_file(h, invariant)
+    for extra_file in extra_files:
+        _hash_file(h, extra_file)
+    return h.hexdigest()
+
+
+def _entry_dir(cache_root: Path, key: str) -> Path:
+    return cache_root / key[:2] / key
+
+
+def cache_lookup(cache_root: Path, key: str) -> Path | None:
+    """Return the cached failed.log for `key`, or None on a miss.
+
+    The returned path does not exist if the cached run reported no violations.
+    """
+    entry = _entry_dir(cache_root, key)
+    if not (entry / CACHE_META).exists():
+        return None
+    return entry / CACHED_FAILED_LOG
+
+
+def cache_store(cache_root: Path, key: str, failed_log: Path, meta: dict):
+    """Store the failed.log of a run under `key`, atomically."""
+    entry = _entry_dir(cache_root, key)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key}_", dir=entry.parent))
+    try:
+        if failed_log.exists():
+            shutil.copyfile(failed_log, tmp_dir / CACHED_FAILED_LOG)
+        with open(tmp_dir / CACHE_META, "w") as f:
+            json.dump({**meta, "key": key, "stored_at": time.time()}, f, indent=4)
+        os.rename(tmp_dir, entry)
+    except OSError:
+        # another worker stored the same key first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
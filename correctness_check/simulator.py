@@ -1,70 +1,521 @@
 import argparse
+import bisect
+import heapq
+import itertools
 import json
+import math
 import os
 import subprocess
+import tempfile
 import threading
 import time
+from array import array
+from collections import deque
+from pathlib import Path
+
+from checker_monitor import (
+    list_trace_files,
+    read_file_offsets,
+    stop_checker,
+    wait_until_idle,
+    wait_until_opened,
+)
+from invariant_json import iter_json_objects
+
+# number of events held back to absorb timestamps that are only slightly out of order
+REORDER_WINDOW = 10000
+# read buffer used when streaming the input traces
+READ_CHUNK_SIZE = 1 << 20
+
+
+def watched_events(inv_path):
+    """Predicate for the trace records the online checker checks invariants on.
+
+    Violations are only reported while checking such a record, so these are
+    the events a violation can refer to. Like traincheck's online checker,
+    variable records are matched by var_type and API records by function,
+    against the params of all invariants.
+    """
+    apis, var_types = set(), set()
+    for inv in iter_json_objects(inv_path):
+        for param in inv["params"]:
+            if "api_full_name" in param:
+                apis.add(param["api_full_name"])
+            if "var_type" in param:
+                var_types.add(param["var_type"])
+
+    def is_watched(record):
+        if record.get("var_name") is not None:
+            return record.get("var_type") in var_types
+        if record.get("func_call_id") is not None:
+            return record.get("function") in apis
+        return False
+
+    return is_watched
+
+
+def read_events(input_file, is_watched=None, verbose=True):
+    """Stream (time, line, watched) from a trace file without loading it into memory."""
+    with open(input_file, "r", buffering=READ_CHUNK_SIZE) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                watched = is_watched is not None and is_watched(record)
+                yield record["time"], line.strip(), watched
+            except json.JSONDecodeError as e:
+                if verbose:
+                    print(f"Skipping invalid JSON: {e}")
+
+
+def _write_sorted_run(run, tmp_dir, run_idx):
+    run.sort(key=lambda x: x[0])
+    run_path = os.path.join(tmp_dir, f"run_{run_idx}")
+    with open(run_path, "w") as f:
+        for current_time, line, watched in run:
+            f.write(f"{current_time}\t{int(watched)}\t{line}\n")
+    return run_path
+
+
+def _read_sorted_run(run_path):
+    with open(run_path, "r", buffering=READ_CHUNK_SIZE) as f:
+        for entry in f:
+            current_time, watched, line = entry.rstrip("\n").split("\t", 2)
+            yield json.loads(current_time), line, watched == "1"
+
+
+def external_sort_events(events, run_size=REORDER_WINDOW):
+    """Sort an arbitrary event stream by spilling sorted runs to disk and merging them."""
+    with tempfile.TemporaryDirectory(prefix="simulator_sort_") as tmp_dir:
+        run_paths = []
+        run = []
+        for event in events:
+            run.append(event)
+            if len(run) >= run_size:
+                run_paths.append(_write_sorted_run(run, tmp_dir, len(run_paths)))
+                run = []
+        if run:
+            run_paths.append(_write_sorted_run(run, tmp_dir, len(run_paths)))
+        run = []
+        yield from heapq.merge(
+            *[_read_sorted_run(run_path) for run_path in run_paths],
+            key=lambda x: x[0],
+        )
+
+
+def sorted_events(input_file, window=REORDER_WINDOW, is_watched=None):
+    """Yield the events of a trace file in time order with bounded memory.
+
+    The file is read once, through a heap of `window` events that sorts
+    timestamps that are only slightly out of order, keeping ties in input
+    order. An event older than one already yielded shows that the file is not
+    almost sorted: the buffered events and the rest of the file are then
+    merged with an external sort. Events older than the last yielded one can
+    no longer be replayed in order and come first, late.
+    """
+    events = read_events(input_file, is_watched)
+    buffer = []
+    last_time = None
+    for seq, (current_time, line, watched) in enumerate(events):
+        if last_time is not None and current_time < last_time:
+            print(
+                f"{input_file} is not almost sorted, falling back to an external sort"
+            )
+            buffered = [
+                (t, buffered_line, w) for t, _, buffered_line, w in sorted(buffer)
+            ]
+            rest = itertools.chain(buffered, [(current_time, line, watched)], events)
+            n_late = 0
+            for event in external_sort_events(rest, window):
+                n_late += event[0] < last_time
+                yield event
+            print(
+                f"WARNING: {n_late} events of {input_file} were more than "
+                f"{window} events out of order and were replayed late"
+            )
+            return
+        heapq.heappush(buffer, (current_time, seq, line, watched))
+        if len(buffer) > window:
+            last_time, _, line, watched = heapq.heappop(buffer)
+            yield last_time, line, watched
+    while buffer:
+        current_time, _, line, watched = heapq.heappop(buffer)
+        yield current_time, line, watched
+
+
+def _tag_events(events, file_idx):
+    for current_time, line, watched in events:
+        yield current_time, file_idx, line, watched
+
+
+class ReplayLog:
+    """What the replay wrote to each output file, and when.
+
+    Byte offsets and write times are kept per output file only for the
+    events the checker has not read yet, so that its read offsets can be
+    mapped back to events; they are dropped once its read offset is past
+    them. Trace timestamps and write times are kept, in replay order, only
+    for the events a violation can be reported on (see `watched_events`),
+    to look up when such an event was written.
+    """
+
+    def __init__(self, output_files):
+        self.output_files = [Path(f).resolve() for f in output_files]
+        # (end offset, write time) of the unread events of each file
+        self.unread = [deque() for _ in output_files]
+        self.written = [0] * len(output_files)
+        self.consumed = [0] * len(output_files)
+        self.tracking = True
+        self.event_times = array("q")
+        self.event_write_ns = array("q")
+        self.start_ns = None
+        self.end_ns = None
+
+    def record(self, file_idx, end_offset, event_time, write_ns, watched):
+        # count before appending, so a concurrent `consume` never sees more
+        # consumed than written events
+        self.written[file_idx] += 1
+        if self.tracking:
+            self.unread[file_idx].append((end_offset, write_ns))
+        if watched:
+            self.event_times.append(int(event_time))
+            self.event_write_ns.append(write_ns)
+
+    def write_time_of(self, event_time):
+        """When the last watched event with trace timestamp <= `event_time` was written."""
+        idx = bisect.bisect_right(self.event_times, int(event_time)) - 1
+        if idx < 0:
+            return None
+        return self.event_write_ns[idx]
+
+    def written_events(self):
+        return sum(self.written)
+
+    def consume(self, read_offsets):
+        """Drop the events that lie entirely before the checker's read offsets.
+
+        Returns the number of events consumed so far per file.
+        """
+        for output_file, unread, file_idx in zip(
+            self.output_files, self.unread, itertools.count()
+        ):
+            read_offset = read_offsets.get(output_file, 0)
+            while unread and unread[0][0] <= read_offset:
+                unread.popleft()
+                self.consumed[file_idx] += 1
+        return list(self.consumed)
+
+    def stop_tracking(self):
+        """Stop keeping offsets once the checker's reads can no longer be sampled."""
+        self.tracking = False
+        for unread in self.unread:
+            unread.clear()
+
+
+class IngestMonitor(threading.Thread):
+    """Periodically samples how far the checker has read into the replayed files."""
+
+    def __init__(self, process, replay_log, interval=0.5):
+        super().__init__(daemon=True)
+        self.process = process
+        self.replay_log = replay_log
+        self.interval = interval
+        self.samples = []  # (sample time ns, written events, consumed events, lag ns)
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        read_offsets = read_file_offsets(self.process.pid)
+        if read_offsets is None:
+            self.replay_log.stop_tracking()
+            return
+        now = time.monotonic_ns()
+        consumed = self.replay_log.consume(read_offsets)
+        # take the write count after consuming so consumed never exceeds it
+        written = self.replay_log.written_events()
+        # only the monitor removes events, so the first unread one stays
+        oldest_unconsumed = [
+            unread[0][1] for unread in self.replay_log.unread if unread
+        ]
+        lag_ns = now - min(oldest_unconsumed) if oldest_unconsumed else 0
+        self.samples.append((now, written, sum(consumed), lag_ns))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.process.poll() is not None:
+                self.replay_log.stop_tracking()
+                return
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        if self.process.poll() is None:
+            self.sample()
+
+    def report(self):
+        """Summarize replay throughput, the checker's ingest rate and its lag."""
+        log = self.replay_log
+        report = {"written_events": log.written_events()}
+        if log.start_ns is not None and log.end_ns is not None:
+            replay_secs = max(log.end_ns - log.start_ns, 1) / 1e9
+            report["replay_seconds"] = replay_secs
+            report["replay_rate"] = report["written_events"] / replay_secs
+        if not self.samples or log.start_ns is None:
+            return report
+
+        consumed = self.samples[-1][2]
+        # the checker's rate is measured up to the last time it made progress
+        last_progress_ns = log.start_ns
+        prev_consumed = 0
+        for sample_ns, _, n_consumed, _ in self.samples:
+            if n_consumed > prev_consumed:
+                last_progress_ns = sample_ns
+                prev_consumed = n_consumed
+        ingest_secs = max(last_progress_ns - log.start_ns, 1) / 1e9
+        report["consumed_events"] = consumed
+        report["ingest_rate"] = consumed / ingest_secs
+        report["max_lag_events"] = max(w - c for _, w, c, _ in self.samples)
+        report["max_lag_seconds"] = max(lag for _, _, _, lag in self.samples) / 1e9
+        report["final_lag_events"] = self.samples[-1][1] - consumed
+        return report
+
+
+def replay(
+    input_files,
+    output_files,
+    speedup=1.0,
+    max_rate=None,
+    burst=False,
+    replay_log=None,
+    is_watched=None,
+):
+    """Replay several trace files from a single event loop on one global clock.
+
+    The per-file sorted streams are k-way merged by timestamp. By default each
+    event is written once its offset from the first event, divided by
+    `speedup`, has elapsed on the wall clock, so the interleaving across files
+    follows the recorded times and sleeping never accumulates drift.
+    `max_rate` instead paces events at a constant rate (events/s), and `burst`
+    writes them as fast as possible. Events matching `is_watched` are
+    marked as such in the `replay_log`.
+    """
+    time_scale = 1e-9 / speedup
+    outs = [open(output_file, "wb") for output_file in output_files]
+    written_bytes = [0] * len(outs)
+    try:
+        merged = heapq.merge(
+            *[
+                _tag_events(sorted_events(input_file, is_watched=is_watched), file_idx)
+                for file_idx, input_file in enumerate(input_files)
+            ],
+            key=lambda x: x[0],
+        )
+        first_time = None
+        start = time.perf_counter()
+        for n_written, (current_time, file_idx, line, watched) in enumerate(merged):
+            if first_time is None:
+                first_time = current_time
+                start = time.perf_counter()
+                if replay_log is not None:
+                    replay_log.start_ns = time.monotonic_ns()
+            if not burst:
+                if max_rate is not None:
+                    deadline = start + n_written / max_rate
+                else:
+                    deadline = start + (current_time - first_time) * time_scale
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            data = (line + "\n").encode()
+            outs[file_idx].write(data)
+            outs[file_idx].flush()
+            written_bytes[file_idx] += len(data)
+            if replay_log is not None:
+                replay_log.record(
+                    file_idx,
+                    written_bytes[file_idx],
+                    current_time,
+                    time.monotonic_ns(),
+                    watched,
+                )
+    finally:
+        for out in outs:
+            out.close()
+        if replay_log is not None:
+            replay_log.end_ns = time.monotonic_ns()
 
 
 def simulate_output_by_time(input_file, output_file):
-    time_scale = 1e-9
-    with open(input_file, "r") as f:
-        lines = f.readlines()
-
-    events = []
-    for line in lines:
-        try:
-            record = json.loads(line)
-            events.append((record["time"], line.strip()))
-        except json.JSONDecodeError as e:
-            print(f"Skipping invalid JSON: {e}")
-
-    events.sort(key=lambda x: x[0])
-
-    with open(output_file, "w") as out:
-        last_time = None
-        for current_time, line in events:
-            if last_time is not None:
-                delta = (current_time - last_time) * time_scale
-                if delta > 0:
-                    time.sleep(delta)
-            # print(line + '\n')
-            out.write(line + "\n")
-            out.flush()
-            last_time = current_time
-
-
-def simulate(dir_path, inv_path):
-    files = [
-        f for f in os.listdir(dir_path) if f.startswith("trace_") or f.endswith(".json")
-    ]
+    replay([input_file], [output_file])
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def detection_latencies(failed_log, replay_log):
+    """Detection latency of every violation in an online checker failed.log.
+
+    The checker stamps each violation with `time.monotonic_ns()` when it is
+    flagged; the violation is attributed to the latest event of its trace,
+    whose write time is looked up among the watched events of the replay log. Both clocks are
+    CLOCK_MONOTONIC, so the difference is the write-to-detection latency.
+    Returns {relation name: [latency in ms, ...]} and {reason: number of
+    violations} for the violations no latency could be computed for.
+    """
+    latencies = {}
+    skipped = {"no_detection_time": 0, "no_trace_time": 0, "not_replayed": 0}
+    for violation in iter_json_objects(failed_log):
+        if "detection_time" not in violation:
+            skipped["no_detection_time"] += 1
+            continue
+        trace = violation.get("trace") or []
+        times = [record["time"] for record in trace if "time" in record]
+        if not times:
+            skipped["no_trace_time"] += 1
+            continue
+        written_ns = replay_log.write_time_of(max(times))
+        if written_ns is None:
+            skipped["not_replayed"] += 1
+            continue
+        relation = violation["invariant"]["relation"]
+        latency_ms = (violation["detection_time"] - written_ns) / 1e6
+        latencies.setdefault(relation, []).append(latency_ms)
+    return latencies, skipped
+
+
+def summarize_latencies(latencies):
+    summary = {}
+    for relation, values in sorted(latencies.items()):
+        values = sorted(values)
+        summary[relation] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+        }
+    return summary
+
+
+def print_latency_report(summary, skipped):
+    n_skipped = sum(skipped.values())
+    if n_skipped:
+        print(
+            f"WARNING: no detection latency for {n_skipped} violations: "
+            f"{skipped['no_detection_time']} without a detection_time, "
+            f"{skipped['no_trace_time']} without trace timestamps, "
+            f"{skipped['not_replayed']} on events before the replay"
+        )
+    if skipped["no_detection_time"]:
+        print(
+            "WARNING: the checker does not stamp violations with detection_time "
+            "(time.monotonic_ns() when flagged), the latencies are incomplete"
+        )
+    if not summary:
+        if n_skipped:
+            print("WARNING: detection latency could not be measured on any violation")
+        else:
+            print("No violations to measure detection latency on")
+        return
+    print(f"{'relation':<40} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for relation, stats in summary.items():
+        print(
+            f"{relation:<40} {stats['count']:>6} {stats['p50_ms']:>10.1f} "
+            f"{stats['p95_ms']:>10.1f} {stats['p99_ms']:>10.1f}"
+        )
+
+
+def print_ingest_report(report):
+    print(f"Replayed {report['written_events']} events", end="")
+    if "replay_seconds" in report:
+        print(
+            f" in {report['replay_seconds']:.2f}s ({report['replay_rate']:.1f} events/s)",
+            end="",
+        )
+    print()
+    if "ingest_rate" not in report:
+        print("Checker ingest could not be sampled (no /proc or checker exited early)")
+        return
+    print(
+        f"Checker ingested {report['consumed_events']} events, "
+        f"sustained {report['ingest_rate']:.1f} events/s"
+    )
+    print(
+        f"Checker lag: max {report['max_lag_events']} events / "
+        f"{report['max_lag_seconds']:.2f}s, {report['final_lag_events']} events left unread"
+    )
+
+
+def simulate(
+    dir_path,
+    inv_path,
+    timeout=20,
+    speedup=1.0,
+    max_rate=None,
+    burst=False,
+    report_path=None,
+    output_dir=None,
+):
+    # the files the checker would pick up from the folder, the same ones the
+    # idle check waits on
+    files = [trace_file.name for trace_file in list_trace_files(Path(dir_path))]
     out_dir = os.path.basename(dir_path) + "_simulated"
     # out_dir = "test"
     os.makedirs(out_dir, exist_ok=True)
-    threadlist = []
-    for file in files:
-        input_path = os.path.join(dir_path, file)
-        output_path = os.path.join(out_dir, f"{file}")
-        threading_obj = threading.Thread(
-            target=simulate_output_by_time, args=(input_path, output_path)
-        )
-        threadlist.append(threading_obj)
-        # simulate_output_by_time(input_path, output_path)
+    input_paths = [os.path.join(dir_path, file) for file in files]
+    output_paths = [os.path.join(out_dir, file) for file in files]
+    # create the outputs up front so the checker can open them right away
+    for output_path in output_paths:
+        open(output_path, "w").close()
 
-    for thread in threadlist:
-        thread.start()
+    if output_dir is None:
+        output_dir = "traincheck_onlinechecker_results_" + time.strftime(
+            "%Y-%m-%d_%H-%M-%S"
+        )
+    failed_log = Path(output_dir) / "failed.log"
 
-    time.sleep(5)
     command = ["traincheck-onlinecheck", "-f", out_dir, "-i", inv_path]
+    command += ["-o", str(output_dir)]
     process = subprocess.Popen(command)
+    trace_files = list_trace_files(Path(out_dir))
+
+    # start replaying once the checker is tailing every output file, waiting
+    # at most 5 seconds as before
+    wait_until_opened(process, trace_files, timeout=5)
 
-    for thread in threadlist:
-        thread.join()
+    replay_log = ReplayLog(output_paths)
+    monitor = IngestMonitor(process, replay_log)
+    monitor.start()
+    replay(
+        input_paths,
+        output_paths,
+        speedup,
+        max_rate,
+        burst,
+        replay_log,
+        watched_events(inv_path),
+    )
+
+    # `timeout` only bounds how long we wait for the checker to catch up
+    wait_until_idle(process, trace_files, Path("."), timeout)
+
+    monitor.stop()
+    stop_checker(process)
 
-    time.sleep(20)
+    report = monitor.report()
+    print_ingest_report(report)
 
-    process.terminate()
-    process.wait()
+    if failed_log.exists():
+        latencies, skipped = detection_latencies(failed_log, replay_log)
+        report["detection_latency"] = summarize_latencies(latencies)
+        report["detection_latency_skipped"] = skipped
+        print_latency_report(report["detection_latency"], skipped)
+
+    if report_path is not None:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=4)
+    return report
 
 
 if __name__ == "__main__":
@@ -84,5 +535,55 @@ if __name__ == "__main__":
         required=True,
         help="Invariants files to check on traces",
     )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=20,
+        help="Upper bound in seconds to wait for the checker to catch up after the replay",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Write the ingest and detection latency report to this JSON file",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        default=None,
+        help="Folder for the checker results, defaults to a timestamped folder in the CWD",
+    )
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument(
+        "--speedup",
+        type=float,
+        default=1.0,
+        help="Replay the recorded timeline X times faster than real time",
+    )
+    pacing.add_argument(
+        "--max-rate",
+        type=float,
+        default=None,
+        help="Ignore the recorded timeline and write events at a constant rate (events/s)",
+    )
+    pacing.add_argument(
+        "--burst",
+        action="store_true",
+        help="Ignore the recorded timeline and write events as fast as possible",
+    )
     args = parser.parse_args()
-    simulate(args.trace_folders[0], args.invariants[0])
+    if args.speedup <= 0:
+        parser.error("--speedup must be greater than 0")
+    if args.max_rate is not None and args.max_rate <= 0:
+        parser.error("--max-rate must be greater than 0")
+    simulate(
+        args.trace_folders[0],
+        args.invariants[0],
+        args.timeout,
+        args.speedup,
+        args.max_rate,
+        args.burst,
+        args.report,
+        args.output_dir,
+    )
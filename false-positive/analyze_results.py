@@ -1,13 +1,11 @@
 import os
-from collections import defaultdict
 
+import numpy as np
 import pandas as pd
 import yaml
+from results_table import ResultsStore
 from run_exp_for_class import EXPS, get_checker_output_dir, get_setup_key
 
-from traincheck.checker import parse_checker_results
-from traincheck.invariant.base_cls import Invariant, read_inv_file
-
 
 def discover_checker_results() -> dict:
     """Requires changing to the directory where the checker output files are stored."""
@@ -36,237 +34,194 @@ def discover_checker_results() -> dict:
     return results
 
 
-def emit_fp_metrics(df: pd.DataFrame):
-    metrics = {}
-    metrics["relation_distribution"] = (
-        df["relation"].value_counts(normalize=True).to_dict()
+def _ratio(numerator: pd.Series, denominator: pd.Series) -> pd.Series:
+    # empty groups give NaN instead of a ZeroDivisionError
+    return (numerator / denominator.replace(0, np.nan)) * 100
+
+
+def emit_fp_metrics(df: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    """False positive metrics of every `by` group, one row per group.
+
+    `df` has one row per invariant and setup, with `status` either "violated"
+    (on any validation program) or "passed".
+    """
+    violated = df["status"] == "violated"
+    passed = df["status"] == "passed"
+    conditional = df["have_precondition"]
+    one_pos_example = df["num_pos_examples"] == 1
+    num_examples = df["num_pos_examples"] + df["num_neg_examples"]
+    flags = pd.DataFrame(
+        {
+            "n": 1,
+            "conditional": conditional,
+            "unconditional": ~conditional,
+            "violated": violated,
+            "conditional_violated": conditional & violated,
+            "unconditional_violated": ~conditional & violated,
+            "one_pos_example": one_pos_example,
+            "violated_one_pos_example": violated & one_pos_example,
+        }
     )
-    metrics["conditional_invariants_percentage"] = (
-        df[df["have_precondition"]].shape[0] / df.shape[0] * 100
+    counts = flags.groupby([df[key] for key in by]).sum()
+    averages = (
+        pd.DataFrame(
+            {
+                "true_invariants_avg_pos_examples": df["num_pos_examples"].where(
+                    passed
+                ),
+                "true_invariants_avg_neg_examples": df["num_neg_examples"].where(
+                    passed
+                ),
+                "true_invariants_avg_examples": num_examples.where(passed),
+                "false_invariants_avg_pos_examples": df["num_pos_examples"].where(
+                    violated
+                ),
+                "false_invariants_avg_neg_examples": df["num_neg_examples"].where(
+                    violated
+                ),
+                "false_invariants_avg_examples": num_examples.where(violated),
+            }
+        )
+        .groupby([df[key] for key in by])
+        .mean()
     )
-    metrics["unconditional_false_positives_percentage"] = (
-        df[(not df["have_precondition"]) & (df["status"] == "violated")].shape[0]
-        / df[not df["have_precondition"]].shape[0]
-        * 100
+    relation_distribution = (
+        df.groupby(by)["relation"].value_counts(normalize=True).unstack(fill_value=0)
     )
-    metrics["conditional_false_positives_percentage"] = (
-        df[(df["have_precondition"]) & (df["status"] == "violated")].shape[0]
-        / df[df["have_precondition"]].shape[0]
-        * 100
+
+    metrics = pd.DataFrame(index=counts.index)
+    metrics["relation_distribution"] = [
+        row[row > 0].to_dict() for _, row in relation_distribution.iterrows()
+    ]
+    metrics["conditional_invariants_percentage"] = _ratio(
+        counts["conditional"], counts["n"]
     )
-    metrics["false_positives_percentage_for_unconditional"] = (
-        df[(not df["have_precondition"]) & (df["status"] == "violated")].shape[0]
-        / df[df["status"] == "violated"].shape[0]
-        * 100
+    metrics["unconditional_false_positives_percentage"] = _ratio(
+        counts["unconditional_violated"], counts["unconditional"]
     )
-    metrics["false_positives_rate"] = (
-        df[df["status"] == "violated"].shape[0] / df.shape[0] * 100
+    metrics["conditional_false_positives_percentage"] = _ratio(
+        counts["conditional_violated"], counts["conditional"]
     )
-    metrics["true_invariants_avg_pos_examples"] = df[df["status"] == "passed"][
-        "num_pos_examples"
-    ].mean()
-    metrics["true_invariants_avg_neg_examples"] = df[df["status"] == "passed"][
-        "num_neg_examples"
-    ].mean()
-    metrics["true_invariants_avg_examples"] = (
-        df[df["status"] == "passed"]["num_pos_examples"]
-        + df[df["status"] == "passed"]["num_neg_examples"]
-    ).mean()
-    metrics["false_invariants_avg_pos_examples"] = df[df["status"] == "violated"][
-        "num_pos_examples"
-    ].mean()
-    metrics["false_invariants_avg_neg_examples"] = df[df["status"] == "violated"][
-        "num_neg_examples"
-    ].mean()
-    metrics["false_invariants_avg_examples"] = (
-        df[df["status"] == "violated"]["num_pos_examples"]
-        + df[df["status"] == "violated"]["num_neg_examples"]
-    ).mean()
-    metrics["false_invariants_with_one_pos_example_percentage"] = (
-        df[(df["status"] == "violated") & (df["num_pos_examples"] == 1)].shape[0]
-        / df[df["status"] == "violated"].shape[0]
-        * 100
+    metrics["false_positives_percentage_for_unconditional"] = _ratio(
+        counts["unconditional_violated"], counts["violated"]
     )
-    if df[df["num_pos_examples"] == 1].shape[0] == 0:
-        metrics["false_invariants_with_one_pos_example_among_all_percentage"] = 0
-    else:
-        metrics["false_invariants_with_one_pos_example_among_all_percentage"] = (
-            df[(df["status"] == "violated") & (df["num_pos_examples"] == 1)].shape[0]
-            / df[df["num_pos_examples"] == 1].shape[0]
-            * 100
-        )
+    metrics["false_positives_rate"] = _ratio(counts["violated"], counts["n"])
+    metrics = metrics.join(averages)
+    metrics["false_invariants_with_one_pos_example_percentage"] = _ratio(
+        counts["violated_one_pos_example"], counts["violated"]
+    )
+    metrics["false_invariants_with_one_pos_example_among_all_percentage"] = _ratio(
+        counts["violated_one_pos_example"], counts["one_pos_example"]
+    ).fillna(0)
     return metrics
 
 
-if __name__ == "__main__":
-    all_results = {}
-    for bench in EXPS:
-        os.chdir(bench)
-        results = discover_checker_results()
-        if results:
-            all_results[bench] = results
-        os.chdir("..")
-
-    all_stats = []
-
-    # for each bench, for each setup, for each program, parse the results
-    global_violated_invs = {}
-    global_passed_invs = {}
-    global_not_triggered_invs = {}
-    global_all_invs = {}
+def update_results_store(all_results: dict) -> ResultsStore:
+    """Parse the checker outputs that are new or changed since the last run."""
+    store = ResultsStore()
+    checker_output_dirs = set()
+    n_parsed = 0
     for bench, setups in all_results.items():
-        os.chdir(bench)
-        global_violated_invs[bench] = {}
-        global_passed_invs[bench] = {}
-        global_not_triggered_invs[bench] = {}
-        global_all_invs[bench] = {}
         for setup, programs in setups.items():
-            global_all_invs[bench][setup] = None
-            global_violated_invs[bench][setup] = defaultdict(lambda: 0)
-            global_passed_invs[bench][setup] = defaultdict(lambda: 0)
-            global_not_triggered_invs[bench][setup] = defaultdict(lambda: 0)
             for program, checker_output_dir in programs:
-                # find the results files
-                result_and_inv_files = os.listdir(checker_output_dir)
-                assert "invariants.json" in result_and_inv_files
-                inv_file = os.path.join(checker_output_dir, "invariants.json")
-                failed_results = [
-                    f for f in result_and_inv_files if f.startswith("failed")
-                ][0]
-                failed_file = os.path.join(checker_output_dir, failed_results)
-                passed_results = [
-                    f for f in result_and_inv_files if f.startswith("passed")
-                ][0]
-                passed_file = os.path.join(checker_output_dir, passed_results)
-                not_triggered_results = [
-                    f for f in result_and_inv_files if f.startswith("not_triggered")
-                ][0]
-                not_triggered_file = os.path.join(
-                    checker_output_dir, not_triggered_results
-                )
-                # analyzing the results
-                failed = parse_checker_results(failed_file)
-                passed = parse_checker_results(passed_file)
-                non_triggered = parse_checker_results(not_triggered_file)
-                invariants = read_inv_file(inv_file)
-
-                if global_all_invs[bench][setup] is None:
-                    global_all_invs[bench][setup] = invariants
-                else:
-                    assert global_all_invs[bench][setup] == invariants
-                assert len(failed) + len(passed) + len(non_triggered) == len(invariants)
+                checker_output_dir = os.path.join(bench, checker_output_dir)
+                checker_output_dirs.add(checker_output_dir)
+                n_parsed += store.update(bench, str(setup), program, checker_output_dir)
+    store.prune(checker_output_dirs)
+    store.save()
+    print(
+        f"Parsed {n_parsed} new or changed of {len(checker_output_dirs)} checker outputs"
+    )
+    return store
+
+
+def check_same_invariants(results: pd.DataFrame):
+    """Every program of a setup must have been checked with the same invariants."""
+    invariant_lists = results.groupby(["bench", "setup", "program"], sort=False)[
+        "invariant_id"
+    ].agg("".join)
+    n_distinct = invariant_lists.groupby(["bench", "setup"]).nunique()
+    mismatched = n_distinct[n_distinct > 1]
+    assert mismatched.empty, f"Different invariants across programs: {mismatched}"
+
+
+def per_setup_status(results: pd.DataFrame) -> pd.DataFrame:
+    """One row per (bench, setup, invariant), violated if it failed on any program."""
+    results = results.assign(violated=results["status"] == "violated")
+    invariants = results.groupby(
+        ["bench", "setup", "invariant_id"], sort=False, as_index=False
+    ).agg(
+        text_description=("text_description", "first"),
+        relation=("relation", "first"),
+        violated=("violated", "any"),
+        have_precondition=("have_precondition", "first"),
+        num_pos_examples=("num_pos_examples", "first"),
+        num_neg_examples=("num_neg_examples", "first"),
+    )
+    invariants["status"] = np.where(invariants["violated"], "violated", "passed")
+    return invariants.drop(columns="violated")
 
-                for res in failed:
-                    global_violated_invs[bench][setup][
-                        (Invariant.from_dict(res["invariant"]))
-                    ] += 1
-                for res in non_triggered:
-                    global_not_triggered_invs[bench][setup][
-                        (Invariant.from_dict(res["invariant"]))
-                    ] += 1
-                for res in passed:
-                    global_passed_invs[bench][setup][
-                        (Invariant.from_dict(res["invariant"]))
-                    ] += 1
-            print(f"[{bench}] {setup} statistics:\n", end="")
-            # compute the statistics as well, similar to what is done below, but for each setup separately
-            fp_row_data = []
-            for inv in global_all_invs[bench][setup]:
-                if inv not in global_violated_invs[bench][setup]:
-                    fp_row_data.append(
-                        {
-                            "text_description": inv.text_description,
-                            "relation": inv.relation.__name__,
-                            "status": "passed",
-                            "have_precondition": not inv.precondition.is_unconditional(),
-                            "num_pos_examples": inv.num_positive_examples,
-                            "num_neg_examples": inv.num_negative_examples,
-                        }
-                    )
-                else:
-                    fp_row_data.append(
-                        {
-                            "text_description": inv.text_description,
-                            "relation": inv.relation.__name__,
-                            "status": "violated",
-                            "have_precondition": not inv.precondition.is_unconditional(),
-                            "num_pos_examples": inv.num_positive_examples,
-                            "num_neg_examples": inv.num_negative_examples,
-                        }
-                    )
-            df = pd.DataFrame(fp_row_data)
-            df.to_csv(f"{bench}_{setup}_fp_stats.csv")
 
-            # step 2, compute the statistics
-            stats = emit_fp_metrics(df)
-            stats_no_1_example = emit_fp_metrics(df[df["num_pos_examples"] != 1])
-            stats["bench"] = bench
-            stats["setup"] = setup
-            stats["has_1_example"] = True
-            stats_no_1_example["bench"] = bench
-            stats_no_1_example["setup"] = setup
-            stats_no_1_example["has_1_example"] = False
-            all_stats.append(stats)
-            all_stats.append(stats_no_1_example)
+def print_bench_statistics(bench: str, bench_stats: pd.Series):
+    print(f"[{bench}] statistics:")
+    print("\tDistribution of relation types:")
+    print(pd.Series(bench_stats["relation_distribution"]) * 100)
+    print("\tPrecentage of Conditional Invariants:")
+    print(bench_stats["conditional_invariants_percentage"])
+    print("\tPrecentage of Unconditional Invariants that are false positives:")
+    print(bench_stats["unconditional_false_positives_percentage"])
+    print("\tPrecentage of Conditional Invariants that are false positives:")
+    print(bench_stats["conditional_false_positives_percentage"])
+    print("\tPrecentage of Invariants that are false positives:")
+    print(bench_stats["false_positives_rate"])
 
-            print("\n")
 
+if __name__ == "__main__":
+    all_results = {}
+    for bench in EXPS:
+        os.chdir(bench)
+        results = discover_checker_results()
+        if results:
+            all_results[bench] = results
         os.chdir("..")
 
-        # now, I want to have some statistics about the invariants
-        # 1. distribution of relation types
-        # 2. numbers of invariants that are violated, passed, not triggered with/without precondition
-        # 2.5 total number of invariants with a precondition
-
-        # step 1, convert the results to a pandas dataframe
-        fp_row_data = []
-        for setup, fp_invs in global_violated_invs[bench].items():
-            for inv in global_all_invs[bench][setup]:
-                if inv not in fp_invs:
-                    fp_row_data.append(
-                        {
-                            "text_description": inv.text_description,
-                            "relation": inv.relation.__name__,
-                            "status": "passed",
-                            "have_precondition": not inv.precondition.is_unconditional(),
-                            "num_pos_examples": inv.num_positive_examples,
-                            "num_neg_examples": inv.num_negative_examples,
-                        }
-                    )
-                else:
-                    fp_row_data.append(
-                        {
-                            "text_description": inv.text_description,
-                            "relation": inv.relation.__name__,
-                            "status": "violated",
-                            "have_precondition": not inv.precondition.is_unconditional(),
-                            "num_pos_examples": inv.num_positive_examples,
-                            "num_neg_examples": inv.num_negative_examples,
-                        }
-                    )
-        df = pd.DataFrame(fp_row_data)
-        df.to_csv(f"{bench}_fp_stats.csv")
-
-        # step 2, compute the statistics
-        print("\tDistribution of relation types:")
-        print(df["relation"].value_counts(normalize=True) * 100)
-        print("\tPrecentage of Conditional Invariants:")
-        print(df[df["have_precondition"]].shape[0] / df.shape[0] * 100)
-        print("\tPrecentage of Unconditional Invariants that are false positives:")
-        print(
-            df[(not df["have_precondition"]) & (df["status"] == "violated")].shape[0]
-            / df[not df["have_precondition"]].shape[0]
-            * 100
+    # step 1, flatten all checker outputs into one columnar table
+    results = update_results_store(all_results).read()
+    check_same_invariants(results)
+    invariants = per_setup_status(results)
+    columns = [
+        "text_description",
+        "relation",
+        "status",
+        "have_precondition",
+        "num_pos_examples",
+        "num_neg_examples",
+    ]
+    for (bench, setup), df in invariants.groupby(["bench", "setup"], sort=False):
+        df[columns].reset_index(drop=True).to_csv(
+            os.path.join(bench, f"{bench}_{setup}_fp_stats.csv")
         )
-        print("\tPrecentage of Conditional Invariants that are false positives:")
-        print(
-            df[(df["have_precondition"]) & (df["status"] == "violated")].shape[0]
-            / df[df["have_precondition"]].shape[0]
-            * 100
+    for bench, df in invariants.groupby("bench", sort=False):
+        df[columns].reset_index(drop=True).to_csv(
+            os.path.join(bench, f"{bench}_fp_stats.csv")
         )
-        print("\tPrecentage of Invariants that are false positives:")
-        print(df[df["status"] == "violated"].shape[0] / df.shape[0] * 100)
 
-# write all stats to csv
-df = pd.DataFrame(all_stats)
-df.to_csv("all_fp_stats.csv")
+    # step 2, compute the statistics for every setup, with and without the
+    # invariants that have a single positive example
+    all_stats = []
+    for has_1_example, df in [
+        (True, invariants),
+        (False, invariants[invariants["num_pos_examples"] != 1]),
+    ]:
+        stats = emit_fp_metrics(df, ["bench", "setup"]).reset_index()
+        stats["has_1_example"] = has_1_example
+        all_stats.append(stats)
+
+    for bench, bench_stats in emit_fp_metrics(invariants, ["bench"]).iterrows():
+        print_bench_statistics(bench, bench_stats)
+
+    # write all stats to csv
+    df = pd.concat(all_stats).sort_values(
+        ["bench", "setup", "has_1_example"], ascending=[True, True, False]
+    )
+    df.reset_index(drop=True).to_csv("all_fp_stats.csv")
@@ -0,0 +1,127 @@
+"""Check one trace against several invariant files in a single pass.
+
+The trace is read and indexed once and every distinct invariant of all the
+invariant files is checked once. Each invariant file still gets its own
+output folder in the layout of `traincheck.checker`:
+<output_dir>/invariants.json and <output_dir>/<trace folder>/{failed,
+not_triggered,passed}.log.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+
+from traincheck.checker import check_engine
+from traincheck.invariant import read_inv_file
+from traincheck.trace import MDNONEJSONEncoder, select_trace_implementation
+
+logger = logging.getLogger(__name__)
+
+
+def invariant_key(inv) -> str:
+    # Invariant equality ignores the precondition, so compare the full dump
+    return json.dumps(inv.to_dict(), sort_keys=True, cls=MDNONEJSONEncoder)
+
+
+def dump_results(results, path: str):
+    with open(path, "w") as f:
+        for res in results:
+            json.dump(res.to_dict(), f, indent=4, cls=MDNONEJSONEncoder)
+            f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check one trace folder against several invariant files, reading the trace once"
+    )
+    parser.add_argument(
+        "-f",
+        "--trace-folder",
+        required=True,
+        help='Folder containing the trace files, which should start with "trace_" or "proxy_log.json"',
+    )
+    parser.add_argument(
+        "-s",
+        "--setup",
+        nargs=2,
+        action="append",
+        required=True,
+        metavar=("INVARIANTS", "OUTPUT_DIR"),
+        help="Invariant file and the checker output folder for it, can be repeated",
+    )
+    parser.add_argument(
+        "--check-relation-first",
+        action="store_true",
+        help="Check the relation first, then the precondition",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        type=str,
+        choices=["pandas", "polars", "dict"],
+        default="pandas",
+        help="Specify the backend to use for Trace",
+    )
+    args = parser.parse_args()
+
+    time_now = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    logging.basicConfig(
+        filename=f"traincheck_checker_batch_{time_now}_{os.getpid()}.log",
+        level=logging.INFO,
+    )
+
+    _, read_trace_file = select_trace_implementation(args.backend)
+    trace_folder = args.trace_folder.rstrip("/")
+    trace_files = [
+        f"{trace_folder}/{file}"
+        for file in os.listdir(trace_folder)
+        if file.startswith("trace_") or file.startswith("proxy_log.json")
+    ]
+    logger.info("Reading traces from %s", "\n".join(trace_files))
+    trace = read_trace_file(trace_files)
+
+    # union of the invariants of all setups, each distinct invariant once
+    setup_invs = {inv_file: read_inv_file(inv_file) for inv_file, _ in args.setup}
+    unique_invs = {}
+    for invs in setup_invs.values():
+        for inv in invs:
+            unique_invs.setdefault(invariant_key(inv), inv)
+    logger.info(
+        "Checking %d distinct invariants out of %d",
+        len(unique_invs),
+        sum(len(invs) for invs in setup_invs.values()),
+    )
+    results = dict(
+        zip(
+            unique_invs,
+            check_engine(trace, list(unique_invs.values()), args.check_relation_first),
+        )
+    )
+
+    trace_parent_folder = os.path.basename(trace_folder)
+    for inv_file, output_dir in args.setup:
+        os.makedirs(os.path.join(output_dir, trace_parent_folder), exist_ok=True)
+        shutil.copyfile(inv_file, os.path.join(output_dir, "invariants.json"))
+        setup_results = [results[invariant_key(inv)] for inv in setup_invs[inv_file]]
+        result_dir = os.path.join(output_dir, trace_parent_folder)
+        dump_results(
+            [res for res in setup_results if not res.check_passed],
+            os.path.join(result_dir, "failed.log"),
+        )
+        dump_results(
+            [res for res in setup_results if not res.triggered],
+            os.path.join(result_dir, "not_triggered.log"),
+        )
+        dump_results(
+            [res for res in setup_results if res.check_passed and res.triggered],
+            os.path.join(result_dir, "passed.log"),
+        )
+        n_failed = sum(not res.check_passed for res in setup_results)
+        print(f"{inv_file}: {n_failed}/{len(setup_results)} invariants failed")
+
+
+if __name__ == "__main__":
+    main()
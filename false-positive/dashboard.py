@@ -0,0 +1,126 @@
+"""Live view of a DAGScheduler run.
+
+Shows the jobs of every stage (done, failed, skipped, running, retrying
+after a backoff, ready, waiting on dependencies), the elapsed time and an
+ETA from the job history, and for every running job the CPU, RSS and I/O
+of its process tree sampled from /proc. On a terminal the view is redrawn
+in place and the scheduler's messages are shown below it, otherwise a
+summary is printed periodically.
+"""
+
+import collections
+import sys
+import threading
+import time
+
+from proc_usage import process_tree, sum_usage
+from scheduler import JOB_STATES, DAGScheduler
+
+# scheduler messages kept for the terminal view
+N_EVENTS = 10
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+class Dashboard(threading.Thread):
+    def __init__(self, scheduler: DAGScheduler, interval: float = 2.0, out=None):
+        super().__init__(daemon=True)
+        self.scheduler = scheduler
+        self.interval = interval
+        self.out = out or sys.stdout
+        self.interactive = self.out.isatty()
+        self.events: collections.deque[str] = collections.deque(maxlen=N_EVENTS)
+        self.stopped = threading.Event()
+        # pid -> (time, cpu seconds, process tree) of the previous sample, for CPU %
+        self.last_cpu: dict[int, tuple[float, float, frozenset[int]]] = {}
+        if self.interactive:
+            self.scheduler.log = self.events.append
+
+    def sample(self, pid: int | None) -> dict | None:
+        if pid is None:
+            return None
+        now = time.monotonic()
+        tree = process_tree(pid)
+        # with the reaped children's CPU time, a child that exits and is waited
+        # for keeps counting towards the tree
+        usage = sum_usage(tree, children=True)
+        if usage is None:
+            return None
+        cpu_seconds = usage.cpu_seconds
+        last_time, last_cpu, last_tree = self.last_cpu.get(pid, (None, None, None))
+        self.last_cpu[pid] = (now, cpu_seconds, frozenset(tree))
+        cpu_percent = None
+        # the time of a process that exited but was not reaped by the tree is
+        # lost, so there is no CPU % for a sample across a change of the tree
+        if last_tree == frozenset(tree) and now > last_time:
+            cpu_percent = max(0, 100 * (cpu_seconds - last_cpu) / (now - last_time))
+        return {
+            "cpu": cpu_percent,
+            "rss_mb": usage.rss_bytes / (1 << 20),
+            "read_mb": usage.read_bytes / (1 << 20),
+            "write_mb": usage.write_bytes / (1 << 20),
+        }
+
+    def render(self, snapshot: dict) -> list[str]:
+        lines = [
+            f"elapsed {format_duration(snapshot['elapsed'])}, "
+            f"ETA {format_duration(snapshot['eta'])}"
+        ]
+        lines.append(f"{'stage':<22}" + "".join(f"{state:>9}" for state in JOB_STATES))
+        for stage, counts in snapshot["stages"].items():
+            lines.append(
+                f"{stage:<22}" + "".join(f"{counts[state]:>9}" for state in JOB_STATES)
+            )
+        if snapshot["running"]:
+            lines.append("")
+            lines.append(
+                f"{'job':<40}{'elapsed':>9}{'est.':>9}{'CPU%':>7}{'RSS MB':>9}{'read MB':>9}{'write MB':>10}"
+            )
+        for job in sorted(snapshot["running"], key=lambda job: -job["elapsed"]):
+            usage = self.sample(job["pid"])
+            line = (
+                f"{job['name'][:39]:<40}{format_duration(job['elapsed']):>9}"
+                f"{format_duration(job['estimate']):>9}"
+            )
+            if usage is not None:
+                cpu = "-" if usage["cpu"] is None else f"{usage['cpu']:.0f}"
+                line += (
+                    f"{cpu:>7}{usage['rss_mb']:>9.0f}"
+                    f"{usage['read_mb']:>9.0f}{usage['write_mb']:>10.0f}"
+                )
+            lines.append(line)
+        # forget processes that are gone
+        running_pids = {job["pid"] for job in snapshot["running"]}
+        for pid in list(self.last_cpu):
+            if pid not in running_pids:
+                del self.last_cpu[pid]
+        return lines
+
+    def draw(self):
+        snapshot = self.scheduler.snapshot()
+        if snapshot is None:
+            return
+        lines = self.render(snapshot)
+        if self.interactive:
+            lines += [""] + list(self.events)
+            # move to the top left and clear the screen before redrawing
+            self.out.write("\x1b[H\x1b[2J" + "\n".join(lines) + "\n")
+        else:
+            self.out.write("\n".join(lines) + "\n\n")
+        self.out.flush()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.draw()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.draw()
+        if self.interactive:
+            self.scheduler.log = print
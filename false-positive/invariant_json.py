@@ -0,0 +1 @@
+../correctness_check/invariant_json.py
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""Infer invariants for several setups in one process.
+
+Every trace folder is read once and the hypotheses of each (trace, relation)
+pair are generated once; a setup combining several traces merges copies of
+the cached per-trace hypotheses instead of re-parsing and re-generating them.
+A trace and its hypotheses are dropped once the last setup reading it ran.
+
+Every setup starts from the random seed of a fresh `traincheck-infer`
+process, so its invariants are the same as those of a standalone run;
+`--check-standalone` verifies that for the first setup.
+"""
+
+import argparse
+import copy
+import datetime
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from invariant_json import invariant_fingerprint, iter_json_objects
+
+from traincheck.infer_engine import InferEngine, save_failed_hypos, save_invs
+from traincheck.invariant import Hypothesis, Relation, relation_pool
+from traincheck.trace import select_trace_implementation
+
+logger = logging.getLogger(__name__)
+
+
+class TraceCache:
+    """Traces and their per-relation hypotheses, loaded on first use.
+
+    `uses` counts the setups reading each trace folder. Every setup calls
+    `release` when done, and a folder is evicted after its last one. Folders
+    not counted in `uses` are kept for the lifetime of the cache.
+    """
+
+    def __init__(
+        self,
+        read_trace_file,
+        disabled_relations: list[Relation],
+        uses: Counter | None = None,
+    ):
+        self.read_trace_file = read_trace_file
+        self.disabled_relations = disabled_relations
+        self.uses = Counter(uses or {})
+        self.traces: dict[str, object] = {}
+        # trace folder -> random state before generation -> (hypotheses, state after)
+        self.hypotheses: dict[str, dict[tuple, tuple[list[Hypothesis], tuple]]] = {}
+
+    def get_trace(self, trace_folder: str):
+        if trace_folder not in self.traces:
+            trace_files = [
+                f"{trace_folder}/{file}"
+                for file in os.listdir(trace_folder)
+                if file.startswith("trace_") or file.startswith("proxy_log.json")
+            ]
+            logger.info("Reading traces from %s", "\n".join(trace_files))
+            self.traces[trace_folder] = self.read_trace_file(trace_files)
+        return self.traces[trace_folder]
+
+    def get_hypotheses(self, trace_folder: str) -> list[Hypothesis]:
+        """Hypotheses of all enabled relations on one trace, in relation pool order.
+
+        Relations may sample with `random`, so the hypotheses depend on the
+        random state the trace is reached with, as they do in a standalone
+        run. They are cached per state, and a cache hit leaves `random` in the
+        state generating them would have.
+
+        Callers get a deep copy since merging and example collection mutate
+        the hypotheses, except the last setup reading the trace, which gets
+        the cached objects themselves.
+        """
+        by_state = self.hypotheses.setdefault(trace_folder, {})
+        state = random.getstate()
+        if state not in by_state:
+            trace = self.get_trace(trace_folder)
+            hypotheses = []
+            for relation in relation_pool:
+                if relation in self.disabled_relations:
+                    continue
+                logger.info(
+                    f"Generating hypotheses for relation: {relation.__name__} on {trace_folder}"
+                )
+                hypotheses.extend(relation.generate_hypothesis(trace))
+            by_state[state] = (hypotheses, random.getstate())
+        if self.uses[trace_folder] == 1:
+            hypotheses, end_state = by_state.pop(state)
+        else:
+            hypotheses, end_state = by_state[state]
+            hypotheses = copy.deepcopy(hypotheses)
+        random.setstate(end_state)
+        return hypotheses
+
+    def release(self, trace_folders: list[str]):
+        """Evict the traces no later setup reads."""
+        for trace_folder in trace_folders:
+            if trace_folder not in self.uses:
+                continue
+            self.uses[trace_folder] -= 1
+            if self.uses[trace_folder] <= 0:
+                del self.uses[trace_folder]
+                self.traces.pop(trace_folder, None)
+                self.hypotheses.pop(trace_folder, None)
+
+
+class CachedInferEngine(InferEngine):
+    """InferEngine that takes the per-trace hypotheses from a TraceCache."""
+
+    def __init__(
+        self,
+        trace_folders: list[str],
+        cache: TraceCache,
+        disabled_relations: list[Relation] = [],
+    ):
+        super().__init__(
+            [cache.get_trace(folder) for folder in trace_folders], disabled_relations
+        )
+        self.trace_folders = trace_folders
+        self.cache = cache
+
+    def generate_hypothesis(self) -> dict[Hypothesis, list[int]]:
+        # same merging as InferEngine.generate_hypothesis, on cached hypotheses
+        hypotheses_and_trace_idxs: dict[Hypothesis, list[int]] = {}
+        hypo_lookup = {}
+        for trace_idx, trace_folder in enumerate(self.trace_folders):
+            for hypo in self.cache.get_hypotheses(trace_folder):
+                if hypo not in hypotheses_and_trace_idxs:
+                    hypotheses_and_trace_idxs[hypo] = [trace_idx]
+                    hypo_lookup[hypo] = hypo
+                else:
+                    hypotheses_and_trace_idxs[hypo].append(trace_idx)
+                    original_hypo = hypo_lookup[hypo]
+                    original_hypo.positive_examples.examples.extend(
+                        hypo.positive_examples.examples
+                    )
+                    original_hypo.negative_examples.examples.extend(
+                        hypo.negative_examples.examples
+                    )
+        logger.info(
+            f"Finished generating hypotheses, found {len(hypotheses_and_trace_idxs)} hypotheses"
+        )
+        return hypotheses_and_trace_idxs
+
+
+def read_fingerprints(inv_file: str) -> Counter:
+    return Counter(
+        invariant_fingerprint(inv_dict) for inv_dict in iter_json_objects(inv_file)
+    )
+
+
+def check_standalone(output: str, trace_folders: list[str], backend: str) -> bool:
+    """Run `traincheck-infer` on one setup and compare its invariants with `output`."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        standalone_output = os.path.join(tmp_dir, "invariants.json")
+        command = [sys.executable, "-m", "traincheck.infer_engine", "-f"]
+        command += [os.path.abspath(folder) for folder in trace_folders]
+        command += ["-o", standalone_output, "-b", backend]
+        # the standalone engine writes its log to the working directory
+        subprocess.run(command, cwd=tmp_dir, check=True)
+        standalone = read_fingerprints(standalone_output)
+    merged = read_fingerprints(output)
+    if merged == standalone:
+        print(f"{output} matches the standalone inference")
+        return True
+    print(
+        f"{output} differs from the standalone inference: "
+        f"{sum((merged - standalone).values())} invariants only in the merged run, "
+        f"{sum((standalone - merged).values())} only in the standalone run"
+    )
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Infer invariants for several setups, reading every trace only once"
+    )
+    parser.add_argument(
+        "-s",
+        "--setup",
+        nargs="+",
+        action="append",
+        required=True,
+        metavar=("OUTPUT", "TRACE_FOLDER"),
+        help="Output invariant file followed by the trace folders of one setup, can be repeated",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        type=str,
+        choices=["pandas", "polars", "dict"],
+        default="pandas",
+        help="Specify the backend to use for Trace",
+    )
+    parser.add_argument(
+        "--check-standalone",
+        action="store_true",
+        help="Also run traincheck-infer on the first setup and fail if its invariants differ",
+    )
+    args = parser.parse_args()
+    for setup in args.setup:
+        if len(setup) < 2:
+            parser.error(f"Setup {setup} needs an output file and trace folders")
+
+    logging.basicConfig(
+        filename=f'traincheck_infer_engine_merged_{datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_{os.getpid()}.log',
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)s - %(funcName)20s()] - %(message)s",
+    )
+
+    _, read_trace_file = select_trace_implementation(args.backend)
+    uses = Counter(
+        folder for _, *trace_folders in args.setup for folder in trace_folders
+    )
+    cache = TraceCache(read_trace_file, disabled_relations=[], uses=uses)
+    for output, *trace_folders in args.setup:
+        time_start = time.time()
+        # the random state of a fresh traincheck-infer process
+        random.seed(0)
+        engine = CachedInferEngine(trace_folders, cache)
+        invs, failed_hypos = engine.infer_multi_trace()
+        # the engine holds on to the traces too
+        del engine
+        cache.release(trace_folders)
+        invs = sorted(invs, key=lambda x: x.text_description)
+        logger.info(
+            f"Inference for {output} completed in {time.time() - time_start} seconds."
+        )
+        save_invs(invs, output)
+        save_failed_hypos(failed_hypos, output + ".failed")
+        print(f"Inferred {len(invs)} invariants into {output}")
+
+    if args.check_standalone:
+        output, *trace_folders = args.setup[0]
+        if not check_standalone(output, trace_folders, args.backend):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
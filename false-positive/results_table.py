@@ -0,0 +1,194 @@
+"""Flatten checker outputs into one columnar table.
+
+Every row is one invariant of one setup checked on one validation program.
+Result files are streamed and only the invariant fields are kept, so no
+`Invariant` objects are built. Each checker output folder is stored as its
+own Parquet file and a manifest remembers which version of the folder it
+was built from, so only new or changed outputs are parsed again.
+"""
+
+import hashlib
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from invariant_json import invariant_fingerprint, iter_json_objects
+
+RESULTS_DIR = "fp_results"
+MANIFEST_FILE = "manifest.json"
+
+SCHEMA = pa.schema(
+    [
+        ("bench", pa.string()),
+        ("setup", pa.string()),
+        ("program", pa.string()),
+        ("invariant_id", pa.string()),
+        ("text_description", pa.string()),
+        ("relation", pa.string()),
+        # violated, passed or not_triggered on this program
+        ("status", pa.string()),
+        ("have_precondition", pa.bool_()),
+        ("num_pos_examples", pa.int64()),
+        ("num_neg_examples", pa.int64()),
+    ]
+)
+
+# result file prefix -> status, failed first as in traincheck.checker
+RESULT_STATUSES = {
+    "failed": "violated",
+    "not_triggered": "not_triggered",
+    "passed": "passed",
+}
+
+
+def invariant_id(inv_dict: dict) -> str:
+    return invariant_fingerprint(inv_dict).hex()
+
+
+def has_precondition(inv_dict: dict) -> bool:
+    """Dict version of `not GroupedPreconditions.is_unconditional()`."""
+    return not all(
+        precondition["clauses"] == "Unconditional"
+        for group in inv_dict["precondition"].values()
+        for precondition in group["preconditions"]
+    )
+
+
+def read_checker_output(
+    bench: str, setup: str, program: str, inv_file: str, result_files: dict[str, str]
+) -> dict[str, list]:
+    """Columns for one checker output folder.
+
+    `result_files` maps the prefixes of RESULT_STATUSES to the result logs.
+    """
+    statuses: dict[str, str] = {}
+    n_results = 0
+    for prefix, status in RESULT_STATUSES.items():
+        for result in iter_json_objects(result_files[prefix]):
+            statuses.setdefault(invariant_id(result["invariant"]), status)
+            n_results += 1
+
+    columns: dict[str, list] = {name: [] for name in SCHEMA.names}
+    n_invariants = 0
+    for inv in iter_json_objects(inv_file):
+        inv_id = invariant_id(inv)
+        columns["invariant_id"].append(inv_id)
+        columns["text_description"].append(inv["text_description"])
+        columns["relation"].append(inv["relation"])
+        columns["status"].append(statuses.get(inv_id, "passed"))
+        columns["have_precondition"].append(has_precondition(inv))
+        columns["num_pos_examples"].append(inv["num_positive_examples"])
+        columns["num_neg_examples"].append(inv["num_negative_examples"])
+        n_invariants += 1
+    assert (
+        n_results == n_invariants
+    ), f"{n_results} results for {n_invariants} invariants"
+    columns["bench"] = [bench] * n_invariants
+    columns["setup"] = [setup] * n_invariants
+    columns["program"] = [program] * n_invariants
+    return columns
+
+
+def find_result_file(checker_output_dir: str, prefix: str) -> str:
+    """Result logs are either next to invariants.json or in the per-trace folder the checker creates."""
+    for root, dirs, files in sorted(os.walk(checker_output_dir)):
+        for f in sorted(files):
+            if f.startswith(prefix):
+                return os.path.join(root, f)
+    raise FileNotFoundError(f"No {prefix} results in {checker_output_dir}")
+
+
+def _file_signature(paths: list[str]) -> list:
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append([path, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def _content_hash(paths: list[str]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        h.update(path.encode() + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultsStore:
+    """Per checker output Parquet files plus a manifest of what they were built from.
+
+    The manifest maps every checker output folder to the size and mtime of
+    its files and a hash of their contents. A folder is parsed again only if
+    its files changed; if only the mtimes changed, the hash is used to avoid
+    the parse.
+    """
+
+    def __init__(self, root: str = RESULTS_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        self.manifest: dict[str, dict] = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+
+    def _table_path(self, checker_output_dir: str) -> str:
+        return os.path.join(self.root, checker_output_dir + ".parquet")
+
+    def update(self, bench: str, setup: str, program: str, checker_output_dir: str):
+        """Bring the table of one checker output up to date, returns whether it was parsed."""
+        inv_file = os.path.join(checker_output_dir, "invariants.json")
+        result_files = {
+            prefix: find_result_file(checker_output_dir, prefix)
+            for prefix in RESULT_STATUSES
+        }
+        paths = [inv_file] + list(result_files.values())
+        signature = _file_signature(paths)
+        entry = self.manifest.get(checker_output_dir)
+        table_path = self._table_path(checker_output_dir)
+        if entry is not None and os.path.exists(table_path):
+            if entry["signature"] == signature:
+                return False
+            content_hash = _content_hash(paths)
+            if entry["hash"] == content_hash:
+                entry["signature"] = signature
+                return False
+        else:
+            content_hash = _content_hash(paths)
+
+        columns = read_checker_output(bench, setup, program, inv_file, result_files)
+        os.makedirs(os.path.dirname(table_path), exist_ok=True)
+        pq.write_table(pa.table(columns, schema=SCHEMA), table_path)
+        self.manifest[checker_output_dir] = {
+            "signature": signature,
+            "hash": content_hash,
+        }
+        return True
+
+    def prune(self, checker_output_dirs: set[str]):
+        """Forget checker outputs that no longer exist."""
+        for checker_output_dir in list(self.manifest):
+            if checker_output_dir not in checker_output_dirs:
+                del self.manifest[checker_output_dir]
+                table_path = self._table_path(checker_output_dir)
+                if os.path.exists(table_path):
+                    os.remove(table_path)
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def read(self):
+        tables = [
+            pq.read_table(self._table_path(checker_output_dir), schema=SCHEMA)
+            for checker_output_dir in sorted(self.manifest)
+        ]
+        if not tables:
+            return SCHEMA.empty_table().to_pandas()
+        return pa.concat_tables(tables).to_pandas()
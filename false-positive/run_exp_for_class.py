@@ -1,24 +1,77 @@
 import argparse
+import hashlib
 import os
+import shutil
 import subprocess
-import time
+from importlib import metadata
 
 import yaml
+from dashboard import Dashboard
+from scheduler import DAGScheduler, Job, JobHistory, PipelineState
 
 EXPS = ["CNN", "RNN", "Transformers"]
 
-# get the current time (just date and HH:MM)
-READY_TRACES: list[str] = []
-READY_INVARIANTS: list[str] = []
-
 PROGRAM_TO_PATH = {}
+PROGRAM_TO_TRACE_KEY = {}
 TRACE_OUTPUT_DIR_PREFIX = "trace_"
+# collected traces are kept here across runs, keyed by everything they depend on
+TRACE_STORE_DIR = "collected_traces"
+MERGED_INFERENCE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "merged_inference.py"
+)
+BATCH_CHECKER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "batch_checker.py"
+)
+# peak RSS, CPU usage and duration of previous runs, used to pack jobs
+JOB_HISTORY_FILE = "job_history.json"
+# outcome of every job of the last run, for --resume
+PIPELINE_STATE_FILE = "pipeline_state.json"
 
 
 def get_trace_collection_dir(program) -> str:
     return f"{TRACE_OUTPUT_DIR_PREFIX}{program}"
 
 
+def get_package_version(package: str) -> str:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "not installed"
+
+
+def get_trace_key(program) -> str:
+    """Hash of the program folder (scripts and md-config-var.yml) and the torch and traincheck versions."""
+    h = hashlib.blake2b(digest_size=12)
+    for package in ["torch", "traincheck"]:
+        h.update(f"{package}=={get_package_version(package)}\0".encode())
+    program_dir = PROGRAM_TO_PATH[program]
+    for root, dirs, files in os.walk(program_dir):
+        dirs[:] = sorted(
+            d for d in dirs if not d.startswith(".") and d != "__pycache__"
+        )
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            h.update(os.path.relpath(path, program_dir).encode() + b"\0")
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            h.update(b"\0")
+    return h.hexdigest()
+
+
+def get_trace_store_dir(program) -> str:
+    return os.path.join(TRACE_STORE_DIR, f"{program}_{PROGRAM_TO_TRACE_KEY[program]}")
+
+
+def store_collected_trace(program):
+    """Move a freshly collected trace into the store, replacing any stale copy."""
+    store_dir = get_trace_store_dir(program)
+    os.makedirs(TRACE_STORE_DIR, exist_ok=True)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(get_trace_collection_dir(program), store_dir)
+
+
 def get_inv_file_name(setup: list[str]) -> str:
     setup_names = "_".join(setup["inputs"])
     return f"inv_{setup_names}.json"
@@ -50,15 +103,23 @@ def get_trace_collection_command(program) -> list[str]:
 def get_inv_inference_command(setup) -> list[str]:
     cmd = ["python", "-m", "traincheck.infer_engine", "-f"]
     for program in setup["inputs"]:
-        cmd.append(get_trace_collection_dir(program))
+        cmd.append(get_trace_store_dir(program))
     cmd.append("-o")
     cmd.append(get_inv_file_name(setup))
     return cmd
 
 
+def get_merged_inference_command(setups) -> list[str]:
+    cmd = ["python", MERGED_INFERENCE_SCRIPT]
+    for setup in setups:
+        cmd += ["-s", get_inv_file_name(setup)]
+        cmd += [get_trace_store_dir(program) for program in setup["inputs"]]
+    return cmd
+
+
 def get_inv_checking_command(setup, program) -> list[str]:
     cmd = ["python", "-m", "traincheck.checker", "-f"]
-    cmd.append(get_trace_collection_dir(program))
+    cmd.append(get_trace_store_dir(program))
     cmd.append("-i")
     cmd.append(get_inv_file_name(setup))
     cmd.append("-o")
@@ -66,6 +127,18 @@ def get_inv_checking_command(setup, program) -> list[str]:
     return cmd
 
 
+def get_batch_checking_command(setups, program) -> list[str]:
+    cmd = [
+        "python",
+        BATCH_CHECKER_SCRIPT,
+        "-f",
+        get_trace_store_dir(program),
+    ]
+    for setup in setups:
+        cmd += ["-s", get_inv_file_name(setup), get_checker_output_dir(setup, program)]
+    return cmd
+
+
 def run_command(cmd, block, io_filename) -> subprocess.Popen:
     # run the experiment in a subprocess
     if io_filename:
@@ -84,123 +157,121 @@ def run_command(cmd, block, io_filename) -> subprocess.Popen:
         return process
 
 
-def run_trace_collection(train_programs, valid_programs, parallelism):
-    # run trace collection
-    all_programs = train_programs + valid_programs  # prioritize training programs
-
-    running_experiments: dict[str, subprocess.Popen] = {}
-    while len(READY_TRACES) < len(all_programs):
-        for program in all_programs:
-            time.sleep(
-                5
-            )  # wait for 5 seconds before starting the next experiment or doing any checking
-            if (
-                program not in READY_TRACES
-                and program not in running_experiments
-                and parallelism < 0
-                or len(running_experiments) < parallelism
-            ):
-                # run the trace collection
-                print("Running trace collection for", program)
-                cmd = get_trace_collection_command(program)
-                io_filename = f"{program}_trace_collection.log"
-                process = run_command(cmd, block=False, io_filename=io_filename)
-                running_experiments[program] = process
-
-            # check for failed or completed experiments
-            for program, process in running_experiments.copy().items():
-                if process.poll() is not None:
-                    if process.returncode != 0:
-                        raise Exception(
-                            f"Trace collection failed for {program} due to an unknown error, aborting"
-                        )
-                    else:
-                        print(f"Trace collection completed for {program}")
-                        READY_TRACES.append(program)
-                        del running_experiments[program]
-
-
-def run_invariant_inference(setups):
-    # run invariant inference
-    running_setups = []
-    leftover_setups = setups.copy()
-    while len(leftover_setups) > 0 or len(running_setups) > 0:
-        for setup in leftover_setups:
-            if (
-                not any(setup == running_setup for running_setup, _ in running_setups)
-            ) and all(program in READY_TRACES for program in setup["inputs"]):
-                # run invariant inference
-                print("Running invariant inference for", setup)
-                cmd = get_inv_inference_command(setup)
-                io_filename = "_".join(setup["inputs"]) + "_inference.log"
-                process = run_command(cmd, block=False, io_filename=io_filename)
-                leftover_setups.remove(setup)
-                running_setups.append((setup, process))
-                break
-
-        # check for failed or completed experiments
-        for setup, process in running_setups.copy():
-            if process.poll() is not None:
-                if process.returncode != 0:
-                    print(f"Invariant inference failed for {setup}")
-                    # check for the stderr of this process
-                    # if the error is due to cuda memory out of space, we can retry the experiment
-                    raise Exception(
-                        f"Invariant inference failed for {setup} due to an unknown error, aborting"
-                    )
-                else:
-                    print(f"Invariant inference completed for {setup}")
-                    READY_INVARIANTS.append(setup)
-                    running_setups.remove((setup, process))
-
-    print("Exiting invariant inference loop")
-
-
-def run_invariant_checking(valid_programs, setups):
-    # run invariant checking for each valid program for each setup
-    running_setups = {}
-    leftover_setups = {get_setup_key(setup): valid_programs.copy() for setup in setups}
-
-    while len(leftover_setups) > 0 or len(running_setups) > 0:
-        for setup in READY_INVARIANTS:
-            setup_key = get_setup_key(setup)
-            if setup_key not in leftover_setups:
-                continue
-            for program in leftover_setups[setup_key].copy():
-                if program not in READY_TRACES:
-                    continue
-                # run invariant checking
-                print(f"Running invariant checking for {setup_key} on {program}")
-                cmd = get_inv_checking_command(setup, program)
-                io_filename = f"{program}_invariant_checking.log"
-                process = run_command(cmd, block=False, io_filename=io_filename)
-                if setup_key not in running_setups:
-                    running_setups[setup_key] = []
-                running_setups[setup_key].append((program, process))
-                leftover_setups[setup_key].remove(program)
-
-            if len(leftover_setups[setup_key]) == 0:
-                del leftover_setups[setup_key]
-
-        # check for failed or completed experiments
-        for setup_key, processes in running_setups.copy().items():
-            for program, process in processes.copy():
-                if process.poll() is not None:
-                    if process.returncode != 0:
-                        print(f"Invariant checking failed for {setup_key} on {program}")
-                        # check for the stderr of this process
-                        # if the error is due to cuda memory out of space, we can retry the experiment
-                        raise Exception(
-                            f"Invariant checking failed for {setup_key} on {program} due to an unknown error, aborting"
-                        )
-                    else:
-                        print(
-                            f"Invariant checking completed for {setup_key} on {program}"
-                        )
-                        processes.remove((program, process))
-                        if len(processes) == 0:
-                            del running_setups[setup_key]
-    print("Exiting invariant checking loop")
+def launch_command(cmd, io_filename) -> subprocess.Popen:
+    return run_command(cmd, block=False, io_filename=io_filename)
+
+
+def build_experiment_graph(
+    train_programs,
+    valid_programs,
+    setups,
+    stage_limits,
+    recollect=False,
+    merged_inference=False,
+    batch_checking=False,
+    resume=False,
+    max_retries=0,
+    retry_backoff=30.0,
+) -> DAGScheduler:
+    """collection per program -> inference per setup -> checking per (setup, program)
+
+    Programs whose traces are already in the trace store are not collected
+    again unless `recollect` is set. With `merged_inference`, a single
+    inference job serves all setups so every trace is parsed only once.
+    With `batch_checking`, each validation program is checked against all
+    setups' invariants in one job that reads its trace once.
+    With `resume`, jobs that completed in the previous run are not run again.
+    """
+    history = JobHistory(JOB_HISTORY_FILE)
+    state = PipelineState(PIPELINE_STATE_FILE, resume)
+    scheduler = DAGScheduler(
+        launch_command, stage_limits, history, state, max_retries, retry_backoff
+    )
+    # prioritize training programs
+    for program in train_programs + valid_programs:
+        if not recollect and os.path.isdir(get_trace_store_dir(program)):
+            print(f"Reusing traces for {program} from {get_trace_store_dir(program)}")
+            continue
+        scheduler.add(
+            Job(
+                name=f"collect_{program}",
+                stage="trace collection",
+                cmd=get_trace_collection_command(program),
+                io_filename=f"{program}_trace_collection.log",
+                on_success=lambda program=program: store_collected_trace(program),
+                prepare=lambda program=program: shutil.rmtree(
+                    get_trace_collection_dir(program), ignore_errors=True
+                ),
+                outputs=[get_trace_store_dir(program)],
+            )
+        )
+
+    def collection_deps(programs):
+        return [
+            f"collect_{program}"
+            for program in programs
+            if f"collect_{program}" in scheduler.jobs
+        ]
+
+    if merged_inference:
+        all_inputs = list(dict.fromkeys(p for setup in setups for p in setup["inputs"]))
+        scheduler.add(
+            Job(
+                name="infer_merged",
+                stage="invariant inference",
+                cmd=get_merged_inference_command(setups),
+                io_filename="merged_inference.log",
+                deps=collection_deps(all_inputs),
+                outputs=[get_inv_file_name(setup) for setup in setups],
+            )
+        )
+    inference_jobs = {}
+    for setup in setups:
+        setup_names = "_".join(setup["inputs"])
+        if merged_inference:
+            inference_jobs[setup_names] = "infer_merged"
+            continue
+        inference_jobs[setup_names] = f"infer_{setup_names}"
+        scheduler.add(
+            Job(
+                name=f"infer_{setup_names}",
+                stage="invariant inference",
+                cmd=get_inv_inference_command(setup),
+                io_filename=f"{setup_names}_inference.log",
+                deps=collection_deps(setup["inputs"]),
+                outputs=[get_inv_file_name(setup)],
+            )
+        )
+
+    for program in valid_programs:
+        if batch_checking:
+            scheduler.add(
+                Job(
+                    name=f"check_{program}",
+                    stage="invariant checking",
+                    cmd=get_batch_checking_command(setups, program),
+                    io_filename=f"{program}_invariant_checking.log",
+                    deps=list(dict.fromkeys(inference_jobs.values()))
+                    + collection_deps([program]),
+                    outputs=[
+                        get_checker_output_dir(setup, program) for setup in setups
+                    ],
+                )
+            )
+            continue
+        for setup in setups:
+            setup_names = "_".join(setup["inputs"])
+            scheduler.add(
+                Job(
+                    name=f"check_{setup_names}_{program}",
+                    stage="invariant checking",
+                    cmd=get_inv_checking_command(setup, program),
+                    io_filename=f"{setup_names}_{program}_invariant_checking.log",
+                    deps=[inference_jobs[setup_names]] + collection_deps([program]),
+                    outputs=[get_checker_output_dir(setup, program)],
+                )
+            )
+    return scheduler
 
 
 def cleanup_trace_files():
@@ -224,6 +295,49 @@ if __name__ == "__main__":
     parser.add_argument(
         "--bench", type=str, choices=EXPS, default="CNN", help="Benchmark to run"
     )
+    parser.add_argument(
+        "--recollect",
+        action="store_true",
+        help=f"Collect all traces again instead of reusing the ones in {TRACE_STORE_DIR}",
+    )
+    parser.add_argument(
+        "--merged-inference",
+        action="store_true",
+        help="Infer all setups in one process, parsing every trace and generating its hypotheses once",
+    )
+    parser.add_argument(
+        "--batch-checking",
+        action="store_true",
+        help="Check each validation trace against all setups in one process, reading it once",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"Only run the jobs that failed or did not finish in the previous run, as recorded in {PIPELINE_STATE_FILE}",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="How many times a failed job is retried before its dependents are skipped",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=30.0,
+        help="Seconds before the first retry of a job, doubled for every further retry",
+    )
+    parser.add_argument(
+        "--dashboard",
+        action="store_true",
+        help="Show the progress, ETA and resource usage of the running jobs",
+    )
+    parser.add_argument(
+        "--dashboard-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between dashboard refreshes",
+    )
     args = parser.parse_args()
 
     # steps
@@ -256,21 +370,36 @@ if __name__ == "__main__":
         PROGRAM_TO_PATH[program] = os.path.abspath(f"trainset/{program}")
     for program in valid_programs:
         PROGRAM_TO_PATH[program] = os.path.abspath(f"validset/{program}")
+    for program in train_programs + valid_programs:
+        PROGRAM_TO_TRACE_KEY[program] = get_trace_key(program)
 
     config = yaml.load(open("setups.yml", "r"), Loader=yaml.FullLoader)
     setups = config["setups"]
-    parallelism = config["trace_collection_parallelism"]
-    # print(setups)
-    import threading
-
-    # start the invariant inference thread
-    inference_thread = threading.Thread(target=run_invariant_inference, args=(setups,))
-    inference_thread.start()
-
-    # start the invariant checking thread
-    checking_thread = threading.Thread(
-        target=run_invariant_checking, args=(valid_programs, setups)
+    # upper bounds on top of the core/memory based admission, -1 means no bound
+    stage_limits = {
+        "trace collection": config["trace_collection_parallelism"],
+        "invariant inference": config.get("inference_parallelism", -1),
+        "invariant checking": config.get("checking_parallelism", -1),
+    }
+
+    scheduler = build_experiment_graph(
+        train_programs,
+        valid_programs,
+        setups,
+        stage_limits,
+        args.recollect,
+        args.merged_inference,
+        args.batch_checking,
+        args.resume,
+        args.retries,
+        args.retry_backoff,
     )
-    checking_thread.start()
-    # start the inference and checking thread
-    run_trace_collection(train_programs, valid_programs, parallelism)
+    if not args.dashboard:
+        scheduler.run()
+    else:
+        dashboard = Dashboard(scheduler, args.dashboard_interval)
+        dashboard.start()
+        try:
+            scheduler.run()
+        finally:
+            dashboard.stop()
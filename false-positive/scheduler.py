@@ -0,0 +1,456 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+# estimates for jobs that have never run before
+DEFAULT_JOB_CORES = 1.0
+DEFAULT_JOB_MEM_MB = 4096
+DEFAULT_JOB_DURATION = 600.0
+# fraction of the available memory kept free for the OS and page cache
+MEMORY_HEADROOM = 0.1
+# what a job is doing, as counted per stage by DAGScheduler.snapshot
+JOB_STATES = ("done", "failed", "skipped", "running", "retrying", "ready", "waiting")
+
+
+@dataclass
+class Job:
+    name: str
+    stage: str
+    cmd: list[str]
+    io_filename: str
+    deps: list[str] = field(default_factory=list)
+    # called in the scheduler once the job succeeded, before its dependents start
+    on_success: Callable[[], None] | None = None
+    # called before every attempt, e.g. to remove partial outputs of a failed one
+    prepare: Callable[[], None] | None = None
+    # paths that must still exist for a recorded success to be reused on resume
+    outputs: list[str] = field(default_factory=list)
+
+
+@dataclass
+class JobCost:
+    cores: float
+    mem_mb: float
+    duration: float
+
+
+def available_cores() -> int:
+    return len(os.sched_getaffinity(0))
+
+
+def available_memory_mb() -> float:
+    with open("/proc/meminfo", "r") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("MemAvailable not found in /proc/meminfo")
+
+
+class JobHistory:
+    """Peak RSS, average cores used and duration of every job's last successful run."""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.costs: dict[str, dict] = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self.costs = json.load(f)
+
+    def estimate(self, job: Job) -> JobCost:
+        if job.name in self.costs:
+            cost = self.costs[job.name]
+            return JobCost(cost["cores"], cost["mem_mb"], cost["duration"])
+        # fall back to the average of the same stage, e.g. a new program
+        same_stage = [c for c in self.costs.values() if c.get("stage") == job.stage]
+        if not same_stage:
+            return JobCost(DEFAULT_JOB_CORES, DEFAULT_JOB_MEM_MB, DEFAULT_JOB_DURATION)
+        return JobCost(
+            *(
+                sum(c[key] for c in same_stage) / len(same_stage)
+                for key in ("cores", "mem_mb", "duration")
+            )
+        )
+
+    def record(self, job: Job, cost: JobCost):
+        self.costs[job.name] = {
+            "stage": job.stage,
+            "cores": cost.cores,
+            "mem_mb": cost.mem_mb,
+            "duration": cost.duration,
+        }
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.costs, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+class PipelineState:
+    """Outcome of every job, saved after each change so an interrupted run can be resumed.
+
+    Without `resume` the previous state is discarded and overwritten.
+    """
+
+    def __init__(self, path: str | None, resume: bool = False):
+        self.path = path
+        self.jobs: dict[str, dict] = {}
+        if resume and path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self.jobs = json.load(f)
+
+    def is_done(self, job: Job) -> bool:
+        """Whether the same command succeeded before and its outputs are still there."""
+        entry = self.jobs.get(job.name)
+        return (
+            entry is not None
+            and entry["status"] == "done"
+            and entry["cmd"] == job.cmd
+            and all(os.path.exists(path) for path in job.outputs)
+        )
+
+    def record(self, job: Job, status: str, attempts: int):
+        self.jobs[job.name] = {
+            "stage": job.stage,
+            "cmd": job.cmd,
+            "status": status,
+            "attempts": attempts,
+        }
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.jobs, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+class DAGScheduler:
+    """Run jobs as soon as all of their dependencies have completed.
+
+    Every job is a subprocess started by `launch(cmd, io_filename)`, which must
+    return a Popen object. A pool of worker threads waits on the subprocesses
+    and reports completions through a queue, so the scheduler blocks until
+    something finishes instead of polling.
+
+    Ready jobs are admitted while their estimated cores and peak memory (from
+    `history`) fit in the machine's cores and available memory, longest
+    critical path first. `stage_limits` additionally caps how many jobs of a
+    stage run at once, a negative limit means no cap.
+
+    A failed job is retried up to `max_retries` times, waiting
+    `retry_backoff` seconds before the first retry and twice as long before
+    every next one. A job that keeps failing only skips the jobs depending on
+    it, everything else still runs. Outcomes are checkpointed in `state`;
+    jobs it records as done (along with all of their dependencies) are not
+    run again.
+    """
+
+    def __init__(
+        self,
+        launch: Callable,
+        stage_limits: dict[str, int],
+        history: JobHistory | None = None,
+        state: PipelineState | None = None,
+        max_retries: int = 0,
+        retry_backoff: float = 30.0,
+    ):
+        for stage, limit in stage_limits.items():
+            if limit == 0:
+                # no job of the stage could ever start
+                raise ValueError(
+                    f"Stage limit of {stage} is 0, use a positive limit or -1 for no limit"
+                )
+        self.launch = launch
+        self.stage_limits = stage_limits
+        self.history = history or JobHistory(None)
+        self.state = state or PipelineState(None)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.attempts: dict[str, int] = {}
+        # jobs waiting out their backoff before being ready again -> when it ends
+        self.retrying: dict[str, float] = {}
+        self.jobs: dict[str, Job] = {}
+        self.dependents: dict[str, list[str]] = {}
+        self.n_pending_deps: dict[str, int] = {}
+        self.costs: dict[str, JobCost] = {}
+        self.priority: dict[str, float] = {}
+        self.ready: list[str] = []
+        self.running: dict[str, int] = {stage: 0 for stage in stage_limits}
+        self.reserved_cores = 0.0
+        self.reserved_mem_mb = 0.0
+        self.total_cores = available_cores()
+        self.total_mem_mb = available_memory_mb() * (1 - MEMORY_HEADROOM)
+        self.completed: queue.Queue = queue.Queue()
+        # progress, read by `snapshot` from other threads under `lock`
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.started: dict[str, float] = {}
+        self.pids: dict[str, int] = {}
+        self.finished: dict[str, str] = {}
+        # where progress messages go, a dashboard can redirect them
+        self.log: Callable[[str], None] = print
+
+    def add(self, job: Job):
+        assert job.name not in self.jobs, f"Duplicate job {job.name}"
+        assert job.stage in self.stage_limits, f"Unknown stage {job.stage}"
+        self.jobs[job.name] = job
+        self.dependents.setdefault(job.name, [])
+
+    def _execute(self, job: Job) -> tuple[int, JobCost]:
+        if job.prepare is not None:
+            job.prepare()
+        start = time.monotonic()
+        process = self.launch(job.cmd, job.io_filename)
+        with self.lock:
+            self.pids[job.name] = process.pid
+        # wait4 instead of wait() to also get the peak RSS and CPU time of the
+        # job and all of its (waited for) child processes
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        duration = time.monotonic() - start
+        cost = JobCost(
+            cores=(rusage.ru_utime + rusage.ru_stime) / max(duration, 1e-3),
+            mem_mb=rusage.ru_maxrss / 1024,
+            duration=duration,
+        )
+        return process.returncode, cost
+
+    def _compute_priorities(self):
+        """Critical path length from each job to the end of the graph."""
+
+        def visit(name: str) -> float:
+            if name not in self.priority:
+                downstream = [visit(dep) for dep in self.dependents[name]]
+                self.priority[name] = self.costs[name].duration + max(
+                    downstream, default=0.0
+                )
+            return self.priority[name]
+
+        for name in self.jobs:
+            visit(name)
+
+    def _fits(self, job: Job) -> bool:
+        limit = self.stage_limits[job.stage]
+        if 0 <= limit <= self.running[job.stage]:
+            return False
+        if not any(self.running.values()):
+            # always make progress, even if a job is estimated not to fit
+            return True
+        cost = self.costs[job.name]
+        return (
+            self.reserved_cores + cost.cores <= self.total_cores
+            and self.reserved_mem_mb + cost.mem_mb <= self.total_mem_mb
+        )
+
+    def _dispatch(self, pool: ThreadPoolExecutor):
+        self.ready.sort(key=lambda name: self.priority[name], reverse=True)
+        for name in list(self.ready):
+            job = self.jobs[name]
+            if not self._fits(job):
+                continue
+            cost = self.costs[name]
+            self.log(
+                f"Running {job.stage} for {job.name} "
+                f"(est. {cost.cores:.1f} cores, {cost.mem_mb:.0f}MB, {cost.duration:.0f}s)"
+            )
+            self.ready.remove(name)
+            self.running[job.stage] += 1
+            self.reserved_cores += cost.cores
+            self.reserved_mem_mb += cost.mem_mb
+            self.started[name] = time.monotonic()
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            self.state.record(job, "running", self.attempts[name])
+            future = pool.submit(self._execute, job)
+            future.add_done_callback(lambda f, job=job: self.completed.put((job, f)))
+
+    def _handle_completion(self, job: Job, future):
+        """Release the resources of a finished job and retry it, fail it or unblock its dependents."""
+        self.running[job.stage] -= 1
+        self.reserved_cores -= self.costs[job.name].cores
+        self.reserved_mem_mb -= self.costs[job.name].mem_mb
+        try:
+            returncode, cost = future.result()
+        except Exception as e:
+            returncode, cost = str(e), None
+        if returncode == 0:
+            self.log(
+                f"{job.stage} completed for {job.name} in {cost.duration:.0f}s "
+                f"(peak {cost.mem_mb:.0f}MB, {cost.cores:.1f} cores)"
+            )
+            self.history.record(job, cost)
+            self.history.save()
+            if job.on_success is not None:
+                try:
+                    job.on_success()
+                except Exception as e:
+                    returncode = f"post-processing: {e}"
+        if returncode != 0:
+            self._handle_failure(job, returncode)
+            return
+        self._finish(job, "done")
+        for name in self.dependents[job.name]:
+            self.n_pending_deps[name] -= 1
+            if self.n_pending_deps[name] == 0:
+                self.ready.append(name)
+
+    def _handle_failure(self, job: Job, reason):
+        attempt = self.attempts[job.name]
+        if attempt <= self.max_retries:
+            delay = self.retry_backoff * 2 ** (attempt - 1)
+            self.log(
+                f"{job.stage} failed for {job.name} ({reason}), retrying in {delay:.0f}s"
+            )
+            # keep the log of the failed attempt
+            if os.path.exists(job.io_filename):
+                os.replace(job.io_filename, f"{job.io_filename}.{attempt}")
+            self._finish(job, None)
+            self.retrying[job.name] = time.monotonic() + delay
+            timer = threading.Timer(delay, self.completed.put, [(job, None)])
+            timer.daemon = True
+            timer.start()
+            return
+        self.log(
+            f"{job.stage} failed for {job.name} ({reason}) after {attempt} attempts"
+        )
+        self._finish(job, "failed")
+        # everything downstream can never run
+        pending = list(self.dependents[job.name])
+        while pending:
+            name = pending.pop()
+            if name not in self.finished:
+                self._finish(self.jobs[name], "skipped")
+                pending.extend(self.dependents[name])
+
+    def snapshot(self) -> dict | None:
+        """Per-stage job counts, the running jobs and an estimate of the remaining time.
+
+        The estimate is the larger of the remaining critical path and the
+        remaining work (estimated core-seconds) spread over all cores.
+        Returns None before `run` has estimated the jobs.
+        """
+        with self.lock:
+            if len(self.priority) < len(self.jobs):
+                return None
+            now = time.monotonic()
+            stages = {
+                stage: dict.fromkeys(JOB_STATES, 0) for stage in self.stage_limits
+            }
+            running = []
+            critical_path = work = 0.0
+            for name, job in self.jobs.items():
+                if name in self.finished:
+                    stages[job.stage][self.finished[name]] += 1
+                    continue
+                cost = self.costs[name]
+                elapsed = 0.0
+                if name in self.started:
+                    elapsed = now - self.started[name]
+                    stages[job.stage]["running"] += 1
+                    running.append(
+                        {
+                            "name": name,
+                            "stage": job.stage,
+                            "pid": self.pids.get(name),
+                            "elapsed": elapsed,
+                            "estimate": cost.duration,
+                        }
+                    )
+                elif name in self.retrying:
+                    stages[job.stage]["retrying"] += 1
+                elif name in self.ready:
+                    stages[job.stage]["ready"] += 1
+                else:
+                    stages[job.stage]["waiting"] += 1
+                left = max(cost.duration - elapsed, 0.0)
+                if name in self.retrying:
+                    left += max(self.retrying[name] - now, 0.0)
+                critical_path = max(
+                    critical_path, self.priority[name] - cost.duration + left
+                )
+                work += left * cost.cores
+            return {
+                "elapsed": now - self.start_time,
+                "stages": stages,
+                "running": running,
+                "eta": max(critical_path, work / self.total_cores),
+            }
+
+    def _finish(self, job: Job, status: str | None):
+        """Record the outcome of a job, None if it will be retried."""
+        if status is not None:
+            self.finished[job.name] = status
+            self.state.record(job, status, self.attempts.get(job.name, 0))
+        self.started.pop(job.name, None)
+        self.pids.pop(job.name, None)
+
+    def _resume(self):
+        """Mark the jobs the state records as done, and whose dependencies are too, as finished."""
+        resumed: dict[str, bool] = {}
+
+        def visit(name: str) -> bool:
+            if name not in resumed:
+                job = self.jobs[name]
+                resumed[name] = self.state.is_done(job) and all(
+                    visit(dep) for dep in job.deps
+                )
+            return resumed[name]
+
+        for name, job in self.jobs.items():
+            if visit(name):
+                self.finished[name] = "done"
+                for dependent in self.dependents[name]:
+                    self.n_pending_deps[dependent] -= 1
+        if any(resumed.values()):
+            self.log(f"Resuming, {sum(resumed.values())} jobs already done")
+
+    def run(self):
+        with self.lock:
+            self.start_time = time.monotonic()
+            for name, job in self.jobs.items():
+                self.costs[name] = self.history.estimate(job)
+                for dep in job.deps:
+                    assert dep in self.jobs, f"{name} depends on unknown job {dep}"
+                    self.dependents[dep].append(name)
+                self.n_pending_deps[name] = len(job.deps)
+            self._resume()
+            self.ready = [
+                name
+                for name in self.jobs
+                if name not in self.finished and self.n_pending_deps[name] == 0
+            ]
+            self._compute_priorities()
+
+        with ThreadPoolExecutor(max_workers=len(self.jobs) or 1) as pool:
+            with self.lock:
+                self._dispatch(pool)
+            while len(self.finished) < len(self.jobs) and (
+                any(self.running.values()) or self.retrying
+            ):
+                job, future = self.completed.get()
+                with self.lock:
+                    if future is None:
+                        # backoff is over
+                        del self.retrying[job.name]
+                        self.ready.append(job.name)
+                    else:
+                        self._handle_completion(job, future)
+                    self._dispatch(pool)
+
+        failed = [name for name, status in self.finished.items() if status == "failed"]
+        if failed:
+            n_skipped = sum(status == "skipped" for status in self.finished.values())
+            raise Exception(
+                f"{', '.join(failed)} failed, skipped {n_skipped} jobs depending on them. "
+                f"See the jobs' logs, finished jobs are recorded in {self.state.path}"
+            )
+        assert len(self.finished) == len(self.jobs), "Dependency cycle between jobs"
@@ -28,9 +28,12 @@ from transformers import (
     set_seed,
 )
 
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 ########################################################################
 # This is a fully working simple example to use Accelerate
@@ -250,9 +253,10 @@ def training_function(config, args):
         else:
             # After the first iteration though, we need to go back to the original dataloader
             active_dataloader = train_dataloader
-        for step, batch in enumerate(active_dataloader):
+        for step, batch in enumerate(PHASE_TIMER.iterate(active_dataloader)):
             # We could avoid this line since we set the accelerator with `device_placement=True`.
-            BATCH_START = time.perf_counter()
+            BATCH_START = time.perf_counter_ns()
+            PHASE_TIMER.start(BATCH_START)
 
             batch.to(accelerator.device)
             outputs = model(**batch)
@@ -261,11 +265,14 @@ def training_function(config, args):
             # We keep track of the loss at each epoch
             if args.with_tracking:
                 total_loss += loss.detach().float()
+            PHASE_TIMER.lap("forward")
             accelerator.backward(loss)
+            PHASE_TIMER.lap("backward")
             if step % gradient_accumulation_steps == 0:
                 optimizer.step()
                 lr_scheduler.step()
                 optimizer.zero_grad()
+            PHASE_TIMER.lap("step")
 
             overall_step += 1
 
@@ -276,9 +283,9 @@ def training_function(config, args):
                         output_dir = os.path.join(args.output_dir, output_dir)
                     accelerator.save_state(output_dir)
 
-            BATCH_END = time.perf_counter()
-            with open(MD_BATCH_FILE_NAME, "a") as f:
-                f.write("%s\n" % (BATCH_END - BATCH_START))
+            BATCH_END = time.perf_counter_ns()
+            PHASE_TIMER.stop(BATCH_END)
+            ITERATION_TIMER.record(BATCH_END - BATCH_START)
         model.eval()
         for step, batch in enumerate(eval_dataloader):
             # We could avoid this line since we set the accelerator with `device_placement=True`.
@@ -29,9 +29,13 @@ from transformers import (
     set_seed,
 )
 
+import iteration_timer
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 ########################################################################
 # This is a fully working simple example to use Accelerate
@@ -255,6 +259,10 @@ def training_function(config, args):
 
         def log_api_call(frame, event, arg):
             """Trace function calls and log API calls."""
+            # the timers run inside the timed window, tracing them would
+            # inflate the iteration and phase times of this method only
+            if frame.f_code.co_filename == iteration_timer.__file__:
+                return None
             if event == "call":
 
                 # Frame data
@@ -335,9 +343,10 @@ def training_function(config, args):
 
         sys.settrace(log_api_call)
 
-        for step, batch in enumerate(active_dataloader):
+        for step, batch in enumerate(PHASE_TIMER.iterate(active_dataloader)):
             # We could avoid this line since we set the accelerator with `device_placement=True`.
-            BATCH_START = time.perf_counter()
+            BATCH_START = time.perf_counter_ns()
+            PHASE_TIMER.start(BATCH_START)
 
             batch.to(accelerator.device)
             outputs = model(**batch)
@@ -346,11 +355,14 @@ def training_function(config, args):
             # We keep track of the loss at each epoch
             if args.with_tracking:
                 total_loss += loss.detach().float()
+            PHASE_TIMER.lap("forward")
             accelerator.backward(loss)
+            PHASE_TIMER.lap("backward")
             if step % gradient_accumulation_steps == 0:
                 optimizer.step()
                 lr_scheduler.step()
                 optimizer.zero_grad()
+            PHASE_TIMER.lap("step")
 
             overall_step += 1
 
@@ -361,9 +373,9 @@ def training_function(config, args):
                         output_dir = os.path.join(args.output_dir, output_dir)
                     accelerator.save_state(output_dir)
 
-            BATCH_END = time.perf_counter()
-            with open(MD_BATCH_FILE_NAME, "a") as f:
-                f.write("%s\n" % (BATCH_END - BATCH_START))
+            BATCH_END = time.perf_counter_ns()
+            PHASE_TIMER.stop(BATCH_END)
+            ITERATION_TIMER.record(BATCH_END - BATCH_START)
         model.eval()
         for step, batch in enumerate(eval_dataloader):
             # We could avoid this line since we set the accelerator with `device_placement=True`.
@@ -16,7 +16,10 @@ import torchvision.transforms as transforms
 import torchvision.utils as vutils
 from traincheck import annotate_stage
 
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
+MD_PHASE_FILE_NAME = "phase_times.csv"
 
 
 parser = argparse.ArgumentParser()
@@ -284,14 +287,15 @@ optimizerG = optim.Adam(netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
 if opt.dry_run:
     opt.niter = 1
 
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 annotate_stage("training")  # ML_DAIKON: stage annotation
 for epoch in range(opt.niter):
-    for i, data in enumerate(dataloader, 0):
+    for i, data in enumerate(PHASE_TIMER.iterate(dataloader), 0):
         annotate_stage("training")  # ML_DAIKON: stage annotation
-        BATCH_START = time.perf_counter()
+        BATCH_START = time.perf_counter_ns()
+        PHASE_TIMER.start(BATCH_START)
         ############################
         # (1) Update D network: maximize log(D(x)) + log(1 - D(G(z)))
         ###########################
@@ -305,7 +309,9 @@ for epoch in range(opt.niter):
 
         output = netD(real_cpu)
         errD_real = criterion(output, label)
+        PHASE_TIMER.lap("forward")
         errD_real.backward()
+        PHASE_TIMER.lap("backward")
         D_x = output.mean().item()
 
         # train with fake
@@ -314,10 +320,13 @@ for epoch in range(opt.niter):
         label.fill_(fake_label)
         output = netD(fake.detach())
         errD_fake = criterion(output, label)
+        PHASE_TIMER.lap("forward")
         errD_fake.backward()
+        PHASE_TIMER.lap("backward")
         D_G_z1 = output.mean().item()
         errD = errD_real + errD_fake
         optimizerD.step()
+        PHASE_TIMER.lap("step")
 
         ############################
         # (2) Update G network: maximize log(D(G(z)))
@@ -326,9 +335,12 @@ for epoch in range(opt.niter):
         label.fill_(real_label)  # fake labels are real for generator cost
         output = netD(fake)
         errG = criterion(output, label)
+        PHASE_TIMER.lap("forward")
         errG.backward()
+        PHASE_TIMER.lap("backward")
         D_G_z2 = output.mean().item()
         optimizerG.step()
+        PHASE_TIMER.lap("step")
 
         print(
             "[%d/%d][%d/%d] Loss_D: %.4f Loss_G: %.4f D(x): %.4f D(G(z)): %.4f / %.4f"
@@ -354,9 +366,9 @@ for epoch in range(opt.niter):
                 "%s/fake_samples_epoch_%03d.png" % (opt.outf, epoch),
                 normalize=True,
             )
-        BATCH_END = time.perf_counter()
-        with open(MD_BATCH_FILE_NAME, "a") as f:
-            f.write("%s\n" % (BATCH_END - BATCH_START))
+        BATCH_END = time.perf_counter_ns()
+        PHASE_TIMER.stop(BATCH_END)
+        ITERATION_TIMER.record(BATCH_END - BATCH_START)
         if opt.dry_run:
             break
     # do checkpointing
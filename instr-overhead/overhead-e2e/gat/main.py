@@ -10,9 +10,12 @@ import torch.nn.functional as F
 from torch import nn
 from torch.optim import Adam
 
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 ################################
 ###  GAT LAYER DEFINITION    ###
@@ -310,7 +313,8 @@ def train_iter(
     mask_val,
     print_every=10,
 ):
-    BATCH_START = time.perf_counter()
+    BATCH_START = time.perf_counter_ns()
+    PHASE_TIMER.start(BATCH_START)
     start_t = time.time()
     model.train()
     optimizer.zero_grad()
@@ -321,8 +325,11 @@ def train_iter(
         output[mask_train], target[mask_train]
     )  # Compute the loss using the training mask
 
+    PHASE_TIMER.lap("forward")
     loss.backward()
+    PHASE_TIMER.lap("backward")
     optimizer.step()
+    PHASE_TIMER.lap("step")
 
     # Evaluate the model performance on training and validation sets
     loss_train, acc_train = test(model, criterion, input, target, mask_train)
@@ -333,9 +340,9 @@ def train_iter(
         print(
             f"Epoch: {epoch:04d} ({(time.time() - start_t):.4f}s) loss_train: {loss_train:.4f} acc_train: {acc_train:.4f} loss_val: {loss_val:.4f} acc_val: {acc_val:.4f}"
         )
-    BATCH_END = time.perf_counter()
-    with open(MD_BATCH_FILE_NAME, "a") as f:
-        f.write("%s\n" % (BATCH_END - BATCH_START))
+    BATCH_END = time.perf_counter_ns()
+    PHASE_TIMER.stop(BATCH_END)
+    ITERATION_TIMER.record(BATCH_END - BATCH_START)
 
 
 def test(model, criterion, input, target, mask):
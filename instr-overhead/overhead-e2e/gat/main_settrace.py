@@ -11,9 +11,13 @@ import torch.nn.functional as F
 from torch import nn
 from torch.optim import Adam
 
+import iteration_timer
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 ################################
 ###  GAT LAYER DEFINITION    ###
@@ -311,7 +315,8 @@ def train_iter(
     mask_val,
     print_every=10,
 ):
-    BATCH_START = time.perf_counter()
+    BATCH_START = time.perf_counter_ns()
+    PHASE_TIMER.start(BATCH_START)
     start_t = time.time()
     model.train()
     optimizer.zero_grad()
@@ -322,8 +327,11 @@ def train_iter(
         output[mask_train], target[mask_train]
     )  # Compute the loss using the training mask
 
+    PHASE_TIMER.lap("forward")
     loss.backward()
+    PHASE_TIMER.lap("backward")
     optimizer.step()
+    PHASE_TIMER.lap("step")
 
     # Evaluate the model performance on training and validation sets
     loss_train, acc_train = test(model, criterion, input, target, mask_train)
@@ -334,9 +342,9 @@ def train_iter(
         print(
             f"Epoch: {epoch:04d} ({(time.time() - start_t):.4f}s) loss_train: {loss_train:.4f} acc_train: {acc_train:.4f} loss_val: {loss_val:.4f} acc_val: {acc_val:.4f}"
         )
-    BATCH_END = time.perf_counter()
-    with open(MD_BATCH_FILE_NAME, "a") as f:
-        f.write("%s\n" % (BATCH_END - BATCH_START))
+    BATCH_END = time.perf_counter_ns()
+    PHASE_TIMER.stop(BATCH_END)
+    ITERATION_TIMER.record(BATCH_END - BATCH_START)
 
 
 def test(model, criterion, input, target, mask):
@@ -472,6 +480,10 @@ if __name__ == "__main__":
 
     def log_api_call(frame, event, arg):
         """Trace function calls and log API calls."""
+        # the timers run inside the timed window, tracing them would
+        # inflate the iteration and phase times of this method only
+        if frame.f_code.co_filename == iteration_timer.__file__:
+            return None
         if event == "call":
 
             # Frame data
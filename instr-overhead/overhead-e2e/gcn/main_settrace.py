@@ -13,12 +13,16 @@ from torch.optim import Adam
 from traincheck import annotate_stage
 from traincheck.instrumentor import meta_vars
 
+import iteration_timer
+from iteration_timer import IterationTimer, PhaseTimer
+
 meta_vars["step"] = 0
 annotate_stage("init")
 
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 
 class GraphConv(nn.Module):
@@ -217,7 +221,8 @@ def train_iter(
     print_every=10,
 ):
     annotate_stage("training")
-    BATCH_START = time.perf_counter()
+    BATCH_START = time.perf_counter_ns()
+    PHASE_TIMER.start(BATCH_START)
     start_t = time.time()
     model.train()
     optimizer.zero_grad()
@@ -228,12 +233,15 @@ def train_iter(
         output[mask_train], target[mask_train]
     )  # Compute the loss using the training mask
 
+    PHASE_TIMER.lap("forward")
     loss.backward()
+    PHASE_TIMER.lap("backward")
     optimizer.step()
+    PHASE_TIMER.lap("step")
 
-    BATCH_END = time.perf_counter()
-    with open(MD_BATCH_FILE_NAME, "a") as f:
-        f.write("%s\n" % (BATCH_END - BATCH_START))
+    BATCH_END = time.perf_counter_ns()
+    PHASE_TIMER.stop(BATCH_END)
+    ITERATION_TIMER.record(BATCH_END - BATCH_START)
     # Evaluate the model performance on training and validation sets
     loss_train, acc_train = test(model, criterion, input, target, mask_train)
     loss_val, acc_val = test(model, criterion, input, target, mask_val)
@@ -355,6 +363,10 @@ if __name__ == "__main__":
 
     def log_api_call(frame, event, arg):
         """Trace function calls and log API calls."""
+        # the timers run inside the timed window, tracing them would
+        # inflate the iteration and phase times of this method only
+        if frame.f_code.co_filename == iteration_timer.__file__:
+            return None
         if event == "call":
 
             # Frame data
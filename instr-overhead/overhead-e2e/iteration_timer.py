@@ -0,0 +1,193 @@
+"""Per-iteration timings kept in memory and written out in bulk.
+
+Appending every duration to a file costs an open/write/close per training
+step, inside the very loop being measured. IterationTimer stores integer
+`time.perf_counter_ns()` deltas in a preallocated array and appends them to
+the file every `flush_every` iterations, once `flush_interval` seconds of
+iterations have accumulated, and at exit. The file format is unchanged: one
+duration in seconds per line, as read by analysis.xsh.
+
+PhaseTimer additionally splits every iteration into waiting for data,
+forward, backward, optimizer step and the rest, written as CSV rows.
+
+Runs that hit the timeout in run_all.xsh get SIGTERM first, on which the
+timers flush before the process dies of the signal as it would have. Only
+if a run also outlives the grace period and is killed with SIGKILL, the
+iterations since the last flush are lost.
+
+Every workload folder links to this file, the traincheck runner puts the
+folder of the original script on PYTHONPATH.
+"""
+
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+from array import array
+
+FLUSH_EVERY = 1000
+FLUSH_INTERVAL = 5.0
+
+# timers of this process, flushed on SIGTERM
+_timers = []
+_previous_sigterm_handler = None
+
+
+def _flush_on_sigterm(signum, frame):
+    # forked processes such as dataloader workers get the signal of the
+    # process group too, but the buffers they inherited are not theirs
+    for timer in _timers:
+        if timer.pid == os.getpid():
+            timer.flush()
+    if callable(_previous_sigterm_handler):
+        _previous_sigterm_handler(signum, frame)
+        return
+    # die of SIGTERM as without the handler, atexit handlers do not run
+    signal.signal(signum, _previous_sigterm_handler or signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def _register(timer):
+    global _previous_sigterm_handler
+    if not _timers and threading.current_thread() is threading.main_thread():
+        _previous_sigterm_handler = signal.signal(signal.SIGTERM, _flush_on_sigterm)
+    _timers.append(timer)
+    atexit.register(timer.flush)
+
+
+class IterationTimer:
+    """Usage, with the end time taken before the call so that it is not timed:
+
+    start = time.perf_counter_ns()
+    ...
+    timer.record(time.perf_counter_ns() - start)
+    """
+
+    # header of the file and values per iteration, none means a single value
+    columns: tuple[str, ...] = ()
+
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = FLUSH_EVERY,
+        flush_interval: float = FLUSH_INTERVAL,
+    ):
+        self.path = path
+        self.width = max(len(self.columns), 1)
+        self.durations = array("q", bytes(8 * self.width * flush_every))
+        self.flush_interval_ns = int(flush_interval * 1e9)
+        self.n = 0
+        self.pending_ns = 0
+        self.pid = os.getpid()
+        self.reset()
+        _register(self)
+
+    def record(self, duration_ns: int):
+        self.durations[self.n] = duration_ns
+        self.n += 1
+        self.pending_ns += duration_ns
+        if self.n == len(self.durations) or self.pending_ns >= self.flush_interval_ns:
+            self.flush()
+
+    def flush(self):
+        if self.n == 0:
+            return
+        # SIGTERM in the middle of the write would make the handler flush the
+        # same rows again, it is delivered once they are written and dropped
+        old_mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+        # the file I/O is timed, a settrace tracer such as the one of
+        # main_settrace.py would log it as calls of the workload
+        tracer = sys.gettrace()
+        sys.settrace(None)
+        try:
+            n = self.n
+            seconds = ["%s" % (d / 1e9) for d in self.durations[:n]]
+            self.n = 0
+            self.pending_ns = 0
+            with open(self.path, "a") as f:
+                f.write(
+                    "".join(
+                        ",".join(seconds[i : i + self.width]) + "\n"
+                        for i in range(0, n, self.width)
+                    )
+                )
+        finally:
+            sys.settrace(tracer)
+            signal.pthread_sigmask(signal.SIG_SETMASK, old_mask)
+
+    def reset(self):
+        """Drop everything recorded so far and truncate the file."""
+        self.n = 0
+        self.pending_ns = 0
+        with open(self.path, "w") as f:
+            f.write(",".join(self.columns) + "\n" if self.columns else "")
+
+
+class PhaseTimer(IterationTimer):
+    """Usage, with the start and end times shared with an IterationTimer:
+
+    for batch in timer.iterate(loader):  # waiting for the batch -> data
+        start = time.perf_counter_ns()
+        timer.start(start)
+        loss = model(batch)
+        timer.lap("forward")
+        loss.backward()
+        timer.lap("backward")
+        optimizer.step()
+        timer.lap("step")
+        end = time.perf_counter_ns()
+        timer.stop(end)  # since the last lap -> other
+
+    A phase lapped several times in one iteration, e.g. the discriminator and
+    generator updates of a GAN, adds up. All phases but data sum up to
+    `end - start`. Phases are timed on the host, on a GPU a phase may also
+    include waiting for kernels queued by an earlier one.
+    """
+
+    columns = ("data", "forward", "backward", "step", "other")
+
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = FLUSH_EVERY,
+        flush_interval: float = FLUSH_INTERVAL,
+    ):
+        super().__init__(path, flush_every, flush_interval)
+        self.index = {phase: i for i, phase in enumerate(self.columns)}
+        self.data_ns = 0
+        self.start_ns = 0
+        self.last_ns = 0
+
+    def iterate(self, iterable):
+        """Yield from `iterable`, timing how long every item takes to arrive."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter_ns()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.data_ns = time.perf_counter_ns() - start
+            yield item
+
+    def start(self, start_ns: int):
+        # the current iteration is the row after the recorded ones
+        self.durations[self.n] = self.data_ns
+        for i in range(self.n + 1, self.n + self.width):
+            self.durations[i] = 0
+        self.data_ns = 0
+        self.start_ns = self.last_ns = start_ns
+
+    def lap(self, phase: str):
+        now = time.perf_counter_ns()
+        self.durations[self.n + self.index[phase]] += now - self.last_ns
+        self.last_ns = now
+
+    def stop(self, end_ns: int):
+        self.durations[self.n + self.width - 1] += end_ns - self.last_ns
+        self.n += self.width
+        self.pending_ns += end_ns - self.start_ns
+        if self.n == len(self.durations) or self.pending_ns >= self.flush_interval_ns:
+            self.flush()
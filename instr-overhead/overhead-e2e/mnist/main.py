@@ -8,11 +8,13 @@ import torch.optim as optim
 from torch.optim.lr_scheduler import StepLR
 from torchvision import datasets, transforms
 
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
-with open("./prestep_times.txt", "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
+PRESTEP_TIMER = IterationTimer("./prestep_times.txt")
 
 
 class Net(nn.Module):
@@ -44,20 +46,23 @@ class Net(nn.Module):
 def train(args, model, device, train_loader, optimizer, epoch):
     model.train()
 
-    for batch_idx, (data, target) in enumerate(train_loader):
-        BATCH_START = time.perf_counter()
+    for batch_idx, (data, target) in enumerate(PHASE_TIMER.iterate(train_loader)):
+        BATCH_START = time.perf_counter_ns()
+        PHASE_TIMER.start(BATCH_START)
         data, target = data.to(device), target.to(device)
         optimizer.zero_grad()
         output = model(data)
         loss = F.nll_loss(output, target)
-        BATCH_END1 = time.perf_counter()
-        with open("./prestep_times.txt", "a") as f:
-            f.write("%s\n" % (BATCH_END1 - BATCH_START))
+        BATCH_END1 = time.perf_counter_ns()
+        PHASE_TIMER.lap("forward")
         loss.backward()
+        PHASE_TIMER.lap("backward")
         optimizer.step()
-        BATCH_END = time.perf_counter()
-        with open(MD_BATCH_FILE_NAME, "a") as f:
-            f.write("%s\n" % (BATCH_END - BATCH_START))
+        PHASE_TIMER.lap("step")
+        BATCH_END = time.perf_counter_ns()
+        PHASE_TIMER.stop(BATCH_END)
+        ITERATION_TIMER.record(BATCH_END - BATCH_START)
+        PRESTEP_TIMER.record(BATCH_END1 - BATCH_START)
         if batch_idx % args.log_interval == 0:
             print(
                 "Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}".format(
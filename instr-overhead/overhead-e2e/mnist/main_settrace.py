@@ -9,9 +9,13 @@ import torch.optim as optim
 from torch.optim.lr_scheduler import StepLR
 from torchvision import datasets, transforms
 
+import iteration_timer
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 
 class Net(nn.Module):
@@ -50,6 +54,10 @@ def train(args, model, device, train_loader, optimizer, epoch):
 
     def log_api_call(frame, event, arg):
         """Trace function calls and log API calls."""
+        # the timers run inside the timed window, tracing them would
+        # inflate the iteration and phase times of this method only
+        if frame.f_code.co_filename == iteration_timer.__file__:
+            return None
         if event == "call":
 
             # Frame data
@@ -126,17 +134,21 @@ def train(args, model, device, train_loader, optimizer, epoch):
 
     sys.settrace(log_api_call)
 
-    for batch_idx, (data, target) in enumerate(train_loader):
-        BATCH_START = time.perf_counter()
+    for batch_idx, (data, target) in enumerate(PHASE_TIMER.iterate(train_loader)):
+        BATCH_START = time.perf_counter_ns()
+        PHASE_TIMER.start(BATCH_START)
         data, target = data.to(device), target.to(device)
         optimizer.zero_grad()
         output = model(data)
         loss = F.nll_loss(output, target)
+        PHASE_TIMER.lap("forward")
         loss.backward()
+        PHASE_TIMER.lap("backward")
         optimizer.step()
-        BATCH_END = time.perf_counter()
-        with open(MD_BATCH_FILE_NAME, "a") as f:
-            f.write("%s\n" % (BATCH_END - BATCH_START))
+        PHASE_TIMER.lap("step")
+        BATCH_END = time.perf_counter_ns()
+        PHASE_TIMER.stop(BATCH_END)
+        ITERATION_TIMER.record(BATCH_END - BATCH_START)
         if batch_idx % args.log_interval == 0:
             print(
                 "Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}".format(
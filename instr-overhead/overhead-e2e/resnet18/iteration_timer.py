@@ -0,0 +1 @@
+../iteration_timer.py
\ No newline at end of file
@@ -23,6 +23,14 @@ import traincheck.instrumentor.tracer as tc_tracer
 from torch.optim.lr_scheduler import StepLR
 from torch.utils.data import Subset
 
+import iteration_timer
+from iteration_timer import IterationTimer, PhaseTimer
+
+MD_BATCH_FILE_NAME = "iteration_times.txt"
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
+
 tc_tracer.DISABLE_WRAPPER = True
 
 model_names = sorted(
@@ -434,9 +442,8 @@ def train(train_loader, model, criterion, optimizer, epoch, device, args):
     # switch to train mode
     model.train()
 
-    MD_BATCH_FILE_NAME = "iteration_times.txt"
-    with open(MD_BATCH_FILE_NAME, "w") as f:
-        f.write("")
+    ITERATION_TIMER.reset()
+    PHASE_TIMER.reset()
 
     end = time.time()
 
@@ -444,6 +451,10 @@ def train(train_loader, model, criterion, optimizer, epoch, device, args):
 
     def log_api_call(frame, event, arg):
         """Trace function calls and log API calls."""
+        # the timers run inside the timed window, tracing them would
+        # inflate the iteration and phase times of this method only
+        if frame.f_code.co_filename == iteration_timer.__file__:
+            return None
         if event == "call":
 
             # Frame data
@@ -521,8 +532,9 @@ def train(train_loader, model, criterion, optimizer, epoch, device, args):
 
     sys.settrace(log_api_call)
 
-    for i, (images, target) in enumerate(train_loader):
-        BATCH_START = time.perf_counter()
+    for i, (images, target) in enumerate(PHASE_TIMER.iterate(train_loader)):
+        BATCH_START = time.perf_counter_ns()
+        PHASE_TIMER.start(BATCH_START)
 
         # measure data loading time
         data_time.update(time.time() - end)
@@ -543,16 +555,19 @@ def train(train_loader, model, criterion, optimizer, epoch, device, args):
 
         # compute gradient and do SGD step
         optimizer.zero_grad()
+        PHASE_TIMER.lap("forward")
         loss.backward()
+        PHASE_TIMER.lap("backward")
         optimizer.step()
+        PHASE_TIMER.lap("step")
 
         # measure elapsed time
         batch_time.update(time.time() - end)
         end = time.time()
-        BATCH_END = time.perf_counter()
+        BATCH_END = time.perf_counter_ns()
 
-        with open(MD_BATCH_FILE_NAME, "a") as f:
-            f.write("%s\n" % (BATCH_END - BATCH_START))
+        PHASE_TIMER.stop(BATCH_END)
+        ITERATION_TIMER.record(BATCH_END - BATCH_START)
 
         if i % args.print_freq == 0:
             progress.display(i + 1)
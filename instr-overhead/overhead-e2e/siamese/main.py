@@ -14,7 +14,12 @@ from torch.utils.data import Dataset
 from torchvision import datasets
 from traincheck import annotate_stage
 
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 
 class SiameseNetwork(nn.Module):
@@ -206,14 +211,17 @@ def train(args, model, device, train_loader, optimizer, epoch):
     annotate_stage("training")
 
     model.train()
-    with open(MD_BATCH_FILE_NAME, "w") as f:
-        f.write("")
+    ITERATION_TIMER.reset()
+    PHASE_TIMER.reset()
 
     # we aren't using `TripletLoss` as the MNIST dataset is simple, so `BCELoss` can do the trick.
     criterion = nn.BCELoss()
 
-    for batch_idx, (images_1, images_2, targets) in enumerate(train_loader):
-        BATCH_START = time.perf_counter()
+    for batch_idx, (images_1, images_2, targets) in enumerate(
+        PHASE_TIMER.iterate(train_loader)
+    ):
+        BATCH_START = time.perf_counter_ns()
+        PHASE_TIMER.start(BATCH_START)
         images_1, images_2, targets = (
             images_1.to(device),
             images_2.to(device),
@@ -222,11 +230,14 @@ def train(args, model, device, train_loader, optimizer, epoch):
         optimizer.zero_grad()
         outputs = model(images_1, images_2).squeeze()
         loss = criterion(outputs, targets)
+        PHASE_TIMER.lap("forward")
         loss.backward()
+        PHASE_TIMER.lap("backward")
         optimizer.step()
-        BATCH_END = time.perf_counter()
-        with open(MD_BATCH_FILE_NAME, "a") as f:
-            f.write("%s\n" % (BATCH_END - BATCH_START))
+        PHASE_TIMER.lap("step")
+        BATCH_END = time.perf_counter_ns()
+        PHASE_TIMER.stop(BATCH_END)
+        ITERATION_TIMER.record(BATCH_END - BATCH_START)
         if batch_idx % args.log_interval == 0:
             print(
                 "Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}".format(
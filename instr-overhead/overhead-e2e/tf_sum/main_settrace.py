@@ -60,9 +60,13 @@ from transformers.utils import (
 )
 from transformers.utils.versions import require_version
 
+import iteration_timer
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 # Will error if the minimal version of Transformers is not installed. Remove at your own risks.
 check_min_version("4.45.0")
@@ -811,6 +815,10 @@ def main():
 
     def log_api_call(frame, event, arg):
         """Trace function calls and log API calls."""
+        # the timers run inside the timed window, tracing them would
+        # inflate the iteration and phase times of this method only
+        if frame.f_code.co_filename == iteration_timer.__file__:
+            return None
         if event == "call":
 
             # Frame data
@@ -902,18 +910,22 @@ def main():
             )
         else:
             active_dataloader = train_dataloader
-        for step, batch in enumerate(active_dataloader):
-            BATCH_START = time.perf_counter()
+        for step, batch in enumerate(PHASE_TIMER.iterate(active_dataloader)):
+            BATCH_START = time.perf_counter_ns()
+            PHASE_TIMER.start(BATCH_START)
             with accelerator.accumulate(model):
                 outputs = model(**batch)
                 loss = outputs.loss
                 # We keep track of the loss at each epoch
                 if args.with_tracking:
                     total_loss += loss.detach().float()
+                PHASE_TIMER.lap("forward")
                 accelerator.backward(loss)
+                PHASE_TIMER.lap("backward")
                 optimizer.step()
                 lr_scheduler.step()
                 optimizer.zero_grad()
+                PHASE_TIMER.lap("step")
 
             # Checks if the accelerator has performed an optimization step behind the scenes
             if accelerator.sync_gradients:
@@ -930,9 +942,9 @@ def main():
                         output_dir = os.path.join(args.output_dir, output_dir)
                     accelerator.save_state(output_dir)
 
-            BATCH_END = time.perf_counter()
-            with open(MD_BATCH_FILE_NAME, "a") as f:
-                f.write("%s\n" % (BATCH_END - BATCH_START))
+            BATCH_END = time.perf_counter_ns()
+            PHASE_TIMER.stop(BATCH_END)
+            ITERATION_TIMER.record(BATCH_END - BATCH_START)
 
             if completed_steps >= args.max_train_steps:
                 break
@@ -12,9 +12,13 @@ from torchvision import datasets, transforms
 from torchvision.utils import save_image
 from traincheck import annotate_stage
 
+import iteration_timer
+from iteration_timer import IterationTimer, PhaseTimer
+
 MD_BATCH_FILE_NAME = "iteration_times.txt"
-with open(MD_BATCH_FILE_NAME, "w") as f:
-    f.write("")
+MD_PHASE_FILE_NAME = "phase_times.csv"
+ITERATION_TIMER = IterationTimer(MD_BATCH_FILE_NAME)
+PHASE_TIMER = PhaseTimer(MD_PHASE_FILE_NAME)
 
 parser = argparse.ArgumentParser(description="VAE MNIST Example")
 parser.add_argument(
@@ -138,6 +142,10 @@ def train(epoch):
 
     def log_api_call(frame, event, arg):
         """Trace function calls and log API calls."""
+        # the timers run inside the timed window, tracing them would
+        # inflate the iteration and phase times of this method only
+        if frame.f_code.co_filename == iteration_timer.__file__:
+            return None
         if event == "call":
 
             # Frame data
@@ -215,20 +223,24 @@ def train(epoch):
     sys.settrace(log_api_call)
     model.train()
     train_loss = 0
-    for batch_idx, (data, _) in enumerate(train_loader):
-        BATCH_START = time.perf_counter()
+    for batch_idx, (data, _) in enumerate(PHASE_TIMER.iterate(train_loader)):
+        BATCH_START = time.perf_counter_ns()
+        PHASE_TIMER.start(BATCH_START)
 
         data = data.to(device)
         optimizer.zero_grad()
         recon_batch, mu, logvar = model(data)
         loss = loss_function(recon_batch, data, mu, logvar)
+        PHASE_TIMER.lap("forward")
         loss.backward()
+        PHASE_TIMER.lap("backward")
         train_loss += loss.item()
         optimizer.step()
+        PHASE_TIMER.lap("step")
 
-        BATCH_END = time.perf_counter()
-        with open(MD_BATCH_FILE_NAME, "a") as f:
-            f.write("%s\n" % (BATCH_END - BATCH_START))
+        BATCH_END = time.perf_counter_ns()
+        PHASE_TIMER.stop(BATCH_END)
+        ITERATION_TIMER.record(BATCH_END - BATCH_START)
 
         if batch_idx % args.log_interval == 0:
             print(
@@ -39,13 +39,29 @@ def show_abs_bar_label(ax, barh, abs_df):
         ax.text(w, h, val_str)
 
 
+def error_bars(df, method):
+    """Distance from the overhead to the ends of its confidence interval.
+
+    Results of older analysis.xsh runs only have a standard deviation.
+    """
+    rows = df[df["method"] == method]
+    if "ci_low" not in rows:
+        return rows["std"].values
+    return np.array(
+        [
+            rows["overhead"].values - rows["ci_low"].values,
+            rows["ci_high"].values - rows["overhead"].values,
+        ]
+    )
+
+
 def plot_overhead(df):
     systrace = df[df["method"] == "systrace"]["overhead"]
-    systrace_std = df[df["method"] == "systrace"]["std"]
+    systrace_err = error_bars(df, "systrace")
     monkey_patch = df[df["method"] == "monkey-patch"]["overhead"]
-    monkey_patch_std = df[df["method"] == "monkey-patch"]["std"]
+    monkey_patch_err = error_bars(df, "monkey-patch")
     selective = df[df["method"] == "selective"]["overhead"]
-    selective_std = df[df["method"] == "selective"]["std"]
+    selective_err = error_bars(df, "selective")
     print(systrace)
 
     figure, ax = plt.subplots(figsize=(10, 4))
@@ -55,7 +71,7 @@ def plot_overhead(df):
         ind,
         systrace.values,
         width - 0.03,
-        yerr=systrace_std.values,
+        yerr=systrace_err,
         capsize=5,
         bottom=0,
         label="settrace",
@@ -66,7 +82,7 @@ def plot_overhead(df):
         ind + width,
         monkey_patch.values,
         width - 0.03,
-        yerr=monkey_patch_std.values,
+        yerr=monkey_patch_err,
         capsize=5,
         bottom=0,
         label="mpatch",
@@ -77,7 +93,7 @@ def plot_overhead(df):
         ind + 2 * width,
         selective.values,
         width - 0.03,
-        yerr=selective_std.values,
+        yerr=selective_err,
         capsize=5,
         bottom=0,
         label="selective",
@@ -0,0 +1 @@
+../correctness_check/proc_usage.py
\ No newline at end of file